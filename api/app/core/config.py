@@ -6,6 +6,10 @@ load_dotenv()
 def get_env(key: str) -> str:
     return os.environ.get(key) or ""
 
+def get_int_env(key: str, default: int) -> int:
+    value = get_env(key)
+    return int(value) if value else default
+
 GEMINI_API_KEY = get_env("GEMINI_API_KEY")
 JWT_SECRET_KEY = get_env("JWT_SECRET_KEY")
 APP_URL = get_env("APP_URL")
@@ -23,6 +27,90 @@ DB_CONFIG = f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{HOST}:3306/{DB_NAM
 CHUNKS_DIR = "uploads/chunk_uploads"
 UPLOAD_DIR = "uploads/docs"
 PROCESSED_DIR = "uploads/processed_files"
+CRAWL_CACHE_DIR = "uploads/crawl_cache"
+SITE_CRAWL_CACHE_DIR = "uploads/site_crawl_cache"
+FRONTIER_DIR = "uploads/frontier"
+OBJECTS_DIR = "uploads/objects"
+UPLOAD_MAX_CHUNKS = get_int_env("UPLOAD_MAX_CHUNKS", 4096)
 
 # VECTOR DB PATH
 VECTOR_DB_DIR = "vector_db"
+VECTOR_BACKEND = get_env("VECTOR_BACKEND") or "chroma"
+VECTOR_COMPACT_PERCENT = get_int_env("VECTOR_COMPACT_PERCENT", 25)
+# numpy backend only: scan int8 (4x less memory) or float16 (2x) copies of the
+# vectors and re-score the best k * VECTOR_RERANK_FACTOR exactly; a larger
+# factor recovers more recall at the cost of more float32 rows read per query
+VECTOR_QUANTIZATION = get_env("VECTOR_QUANTIZATION") or "none"
+VECTOR_RERANK_FACTOR = get_int_env("VECTOR_RERANK_FACTOR", 4)
+EMBED_BATCH_SIZE = get_int_env("EMBED_BATCH_SIZE", 256)
+CHUNK_WINDOW_CHARS = get_int_env("CHUNK_WINDOW_CHARS", 64 * 1024)
+QUERY_CACHE_SIZE = get_int_env("QUERY_CACHE_SIZE", 1024)
+CHUNK_WORKERS = get_int_env("CHUNK_WORKERS", min(4, os.cpu_count() or 2))
+# processes that split and clean chunk text for the CHUNK_WORKERS threads;
+# 0 does that work in the threads themselves
+CHUNK_PROCESSES = get_int_env("CHUNK_PROCESSES", min(4, os.cpu_count() or 2))
+# chunks at least DEDUP_THRESHOLD percent similar to a chunk of another
+# document are dropped at ingestion; 0 turns the check off
+DEDUP_THRESHOLD = get_int_env("DEDUP_THRESHOLD", 85)
+MINHASH_PERMUTATIONS = get_int_env("MINHASH_PERMUTATIONS", 64)
+LSH_BANDS = get_int_env("LSH_BANDS", 16)
+LEXICAL_SEARCH = get_int_env("LEXICAL_SEARCH", 1)
+LEXICAL_RARE_DF = get_int_env("LEXICAL_RARE_DF", 3)
+# BM25 ignores query terms found in more than LEXICAL_MAX_DF_PERCENT of the
+# chunks, and a term with more than LEXICAL_MAX_POSTINGS chunks only adds to
+# the scores of chunks its rarer query terms found
+LEXICAL_MAX_DF_PERCENT = get_int_env("LEXICAL_MAX_DF_PERCENT", 20)
+LEXICAL_MAX_POSTINGS = get_int_env("LEXICAL_MAX_POSTINGS", 5000)
+CONTEXT_CANDIDATES = get_int_env("CONTEXT_CANDIDATES", 6)
+CONTEXT_TOKEN_BUDGET = get_int_env("CONTEXT_TOKEN_BUDGET", 1500)
+RETRIEVAL_MAX_BATCH = get_int_env("RETRIEVAL_MAX_BATCH", 32)
+RETRIEVAL_MAX_WAIT_MS = get_int_env("RETRIEVAL_MAX_WAIT_MS", 5)
+
+# Conversation memory
+CHAT_HISTORY_MESSAGES = get_int_env("CHAT_HISTORY_MESSAGES", 8)
+CHAT_HISTORY_TOKEN_BUDGET = get_int_env("CHAT_HISTORY_TOKEN_BUDGET", 2000)
+# messages kept out of the summary = CHAT_HISTORY_MESSAGES - CHAT_SUMMARY_BATCH
+CHAT_SUMMARY_BATCH = get_int_env("CHAT_SUMMARY_BATCH", 4)
+CHAT_SUMMARY_MAX_TOKENS = get_int_env("CHAT_SUMMARY_MAX_TOKENS", 300)
+
+# Conversation titles and user events
+TITLE_AFTER_MESSAGES = get_int_env("TITLE_AFTER_MESSAGES", 4)
+TITLE_MAX_BATCH = get_int_env("TITLE_MAX_BATCH", 16)
+TITLE_BATCH_WAIT_MS = get_int_env("TITLE_BATCH_WAIT_MS", 500)
+USER_EVENT_QUEUE_SIZE = get_int_env("USER_EVENT_QUEUE_SIZE", 32)
+DISCONNECT_POLL_MS = get_int_env("DISCONNECT_POLL_MS", 250)
+
+# Crawler limits
+CRAWL_CONCURRENCY_PER_REQUEST = get_int_env("CRAWL_CONCURRENCY_PER_REQUEST", 3)
+CRAWL_CONCURRENCY_GLOBAL = get_int_env("CRAWL_CONCURRENCY_GLOBAL", 8)
+
+# Crawler browser pool
+CRAWLER_POOL_SIZE = get_int_env("CRAWLER_POOL_SIZE", 3)
+CRAWLER_MAX_PAGES_PER_BROWSER = get_int_env("CRAWLER_MAX_PAGES_PER_BROWSER", 100)
+CRAWLER_HEALTHCHECK_INTERVAL = get_int_env("CRAWLER_HEALTHCHECK_INTERVAL", 60)
+
+# Crawl result cache
+CRAWL_CACHE_TTL = get_int_env("CRAWL_CACHE_TTL", 6 * 60 * 60)
+CRAWL_CACHE_MAX_MB = get_int_env("CRAWL_CACHE_MAX_MB", 512)
+SITE_CRAWL_CACHE_MAX_MB = get_int_env("SITE_CRAWL_CACHE_MAX_MB", 1024)
+
+# Ingestion
+INGEST_QUEUE_SIZE = get_int_env("INGEST_QUEUE_SIZE", 8)
+INGESTION_CONCURRENCY = get_int_env("INGESTION_CONCURRENCY", 2)
+INGESTION_POLL_INTERVAL = get_int_env("INGESTION_POLL_INTERVAL", 5)
+INGESTION_MAX_ATTEMPTS = get_int_env("INGESTION_MAX_ATTEMPTS", 3)
+CONVERSION_WORKERS = get_int_env("CONVERSION_WORKERS", os.cpu_count() or 2)
+
+# Website training crawl budgets and politeness
+CRAWL_MAX_DEPTH = get_int_env("CRAWL_MAX_DEPTH", 3)
+CRAWL_MAX_PAGES = get_int_env("CRAWL_MAX_PAGES", 1000)
+CRAWL_SITE_CONCURRENCY = get_int_env("CRAWL_SITE_CONCURRENCY", 4)
+CRAWL_PER_HOST_CONCURRENCY = get_int_env("CRAWL_PER_HOST_CONCURRENCY", 2)
+CRAWL_PER_HOST_DELAY_MS = get_int_env("CRAWL_PER_HOST_DELAY_MS", 500)
+STATIC_MIN_TEXT_CHARS = get_int_env("STATIC_MIN_TEXT_CHARS", 200)
+
+# Incremental re-crawl of trained websites
+RECRAWL_INTERVAL = get_int_env("RECRAWL_INTERVAL", 60 * 60)
+RECRAWL_MAX_AGE = get_int_env("RECRAWL_MAX_AGE", 24 * 60 * 60)
+RECRAWL_BATCH_SIZE = get_int_env("RECRAWL_BATCH_SIZE", 200)
+RECRAWL_CONCURRENCY = get_int_env("RECRAWL_CONCURRENCY", 4)
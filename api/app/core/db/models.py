@@ -1,3 +1,4 @@
+import os
 import time
 from datetime import datetime, timezone
 from enum import Enum
@@ -14,9 +15,12 @@ from sqlmodel import (
     String,
     DateTime
 )
+from sqlalchemy.dialects import mysql
 
 def make_short_id() -> str:
-    return hex(int(time.time()))[2:]
+    # microseconds plus a random suffix: unique even for a message and its
+    # reply saved within the same second, and sorted by time
+    return f"{time.time_ns() // 1000:x}{os.urandom(2).hex()}"
 
 
 class TimeStampMixin(SQLModel):
@@ -57,6 +61,8 @@ class Conversations(TimeStampMixin, table=True):
     )
     user_id: uuid.UUID = Field(foreign_key="users.id", nullable=False)
     title: Optional[str] = Field(default=None, index=True)
+    summary: Optional[str] = Field(default=None, sa_column=Column(Text))
+    summarized_count: int = Field(nullable=False, default=0)
 
     owner: Optional[Users] = Relationship(back_populates="conversations")
     messages: List["ChatMessages"] = Relationship(back_populates="conversation")
@@ -71,6 +77,13 @@ class ChatMessages(TimeStampMixin, table=True):
     __tablename__ = "chat_messages"
 
     id: str = Field(default_factory=make_short_id, primary_key=True, index=True)
+    # MySQL DATETIME keeps whole seconds by default, which can't order a
+    # message and its reply; (created_at, id) is the order of a conversation
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_type=DateTime(timezone=True).with_variant(mysql.DATETIME(fsp=6), "mysql"),
+        sa_column_kwargs={"nullable": False}
+    )
     conversation_id: uuid.UUID = Field(foreign_key="conversations.id", nullable=False)
     sender: Sender = Field(nullable=False)
     content: str = Field(sa_column=Column(Text, nullable=False))
@@ -92,6 +105,7 @@ class TrainingDocs(TimeStampMixin, table=True):
     mime_type: str = Field(nullable=False)
     character_count: int = Field(nullable=False, default=0)
     status: TrainingStatus = Field(nullable=False, default=TrainingStatus.pending)
+    content_hash: Optional[str] = Field(default=None, max_length=64, index=True)
 
 class TrainingWebsite(TimeStampMixin, table=True):
     __tablename__ = "training_urls"
@@ -101,4 +115,27 @@ class TrainingWebsite(TimeStampMixin, table=True):
     parent_id: uuid.UUID = Field(nullable=True)
     character_count: int = Field(nullable=False, default=0)
     status: TrainingStatus = Field(nullable=False, default=TrainingStatus.pending)
+    content_hash: Optional[str] = Field(default=None, max_length=64)
+    etag: Optional[str] = Field(default=None)
+    last_modified: Optional[str] = Field(default=None)
+    checked_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
 
+
+class JobKind(str, Enum):
+    document = 'document'
+    document_batch = 'document_batch'
+    website = 'website'
+    recrawl = 'recrawl'
+
+class IngestionJobs(TimeStampMixin, table=True):
+    __tablename__ = "ingestion_jobs"
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
+    kind: JobKind = Field(nullable=False)
+    target_id: Optional[uuid.UUID] = Field(default=None, index=True)
+    payload: str = Field(sa_column=Column(Text, nullable=False))
+    status: TrainingStatus = Field(nullable=False, default=TrainingStatus.pending, index=True)
+    progress: int = Field(nullable=False, default=0)
+    total: int = Field(nullable=False, default=0)
+    attempts: int = Field(nullable=False, default=0)
+    error: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
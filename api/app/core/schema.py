@@ -32,7 +32,7 @@ class CreateChatMessageModel(BaseModel):
 
 class UserChatMessagesModel(BaseModel):
     message: str
-    history: List[ChatHistoryItem]
+    history: Optional[List[ChatHistoryItem]] = None
 
 class ConversationCreateModel(BaseModel):
     title: Optional[str] = None
@@ -54,9 +54,15 @@ class TrainingDocsModel(BaseModel):
     filename: str
     size: int
     mime_type: str
+    digest: Optional[str] = None
+
+class TrainingDocsBatchModel(BaseModel):
+    docs: List[TrainingDocsModel]
 
 class TrainingWebsiteModel(BaseModel):
     url: str
+    max_depth: Optional[int] = None
+    max_pages: Optional[int] = None
 
 class AdminChatTesting(BaseModel):
     message: str
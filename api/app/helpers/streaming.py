@@ -0,0 +1,48 @@
+import asyncio
+from typing import AsyncIterator
+
+from fastapi import Request
+
+from core.config import DISCONNECT_POLL_MS
+
+class ClientDisconnected(Exception):
+    pass
+
+async def cancel_on_disconnect(request: Request, chunks: AsyncIterator[str], poll_interval: float = DISCONNECT_POLL_MS / 1000):
+    """Yield from chunks until they run out or the client goes away.
+
+    Each read of chunks runs as a task raced against a disconnect watcher, so
+    a disconnect is noticed even while waiting on a slow upstream (a crawl, or
+    the first token of an LLM). The pending read is then cancelled, which
+    unwinds chunks and everything it is awaiting, and ClientDisconnected is
+    raised. However the wrapper ends, chunks is closed before it returns.
+    """
+    async def disconnected():
+        while not await request.is_disconnected():
+            await asyncio.sleep(poll_interval)
+
+    watcher = asyncio.create_task(disconnected())
+    pending = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(anext(chunks))
+            await asyncio.wait({pending, watcher}, return_when=asyncio.FIRST_COMPLETED)
+
+            if not pending.done():
+                pending.cancel()
+                await asyncio.wait({pending})
+                raise ClientDisconnected()
+
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                return
+            pending = None
+            yield chunk
+    finally:
+        # the read in flight must have unwound before chunks can be closed
+        watcher.cancel()
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.wait({pending})
+        await chunks.aclose()
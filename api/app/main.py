@@ -6,11 +6,31 @@ from middleware.rate_limit import RateLimitingMiddleware
 from routes import routes
 from core.db import create_db_and_tables
 from core.config import APP_URL
+from services.crawler import crawler_pool
+from services.http_client import close_http_client
+from services.recrawl import recrawl_scheduler
+from services.jobs import job_queue
+from services.titles import title_generator
+from services.markdown_converter import start_conversion_pool, stop_conversion_pool
+from services.rag.retriever import start_chunk_pool, stop_chunk_pool
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    await crawler_pool.start()
+    start_conversion_pool()
+    start_chunk_pool()
+    await job_queue.start()
+    recrawl_scheduler.start()
+    title_generator.start()
     yield
+    await title_generator.stop()
+    await recrawl_scheduler.stop()
+    await job_queue.stop()
+    stop_chunk_pool()
+    stop_conversion_pool()
+    await crawler_pool.close()
+    await close_http_client()
 
 app = FastAPI(title="WeChat AI", lifespan=lifespan)
 
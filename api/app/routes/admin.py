@@ -1,49 +1,85 @@
+import asyncio
 import os
 import uuid
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import StreamingResponse 
-from sqlmodel import Session, delete, select, func
+from sqlmodel import Session, delete, select, func, or_
 
 from core.db import get_session
-from core.db.models import (TrainingDocs, TrainingWebsite, Users, Conversations, ChatMessages, TrainingStatus, UserType)
-from core.schema import TrainingDocsModel, TrainingWebsiteModel, AdminChatTesting
+from core.db.models import (TrainingDocs, TrainingWebsite, Users, Conversations, ChatMessages, TrainingStatus, UserType, IngestionJobs, JobKind)
+from core.schema import TrainingDocsModel, TrainingDocsBatchModel, TrainingWebsiteModel, AdminChatTesting
 from core.config import UPLOAD_DIR, PROCESSED_DIR
-from services.markdown_converter import convert_to_markdown
-from services.rag.retriever import ChromaDBManager
-from services.crawler import crawl_website
-from services.chat_with_gemini import chat_with_gemini_stream
+from helpers.hashing import sha256_file
+from helpers.streaming import cancel_on_disconnect, ClientDisconnected
+from services.content_store import release_object, is_stored_as
+from services.crawler import crawler_pool, crawl_cache, site_cache
+from services.discovery import stats as discovery_stats
+from services.recrawl import stats as recrawl_stats
+from services.ingestion import cromadb, can_resume_website
+from services.rag.retriever import query_cache_stats
+from services.jobs import job_queue, run_blocking
+from services.frontier import CrawlFrontier
+from services.chat_with_gemini import chat_with_gemini_stream, retrieval_batcher, generation_stats
+from services.conversation_memory import conversation_memory, bounded_history
+from services.events import user_events
+from services.titles import title_generator
 
 admin_router = APIRouter(prefix="/admin")
 
-cromadb = ChromaDBManager()
 SessionDep = Annotated[Session, Depends(get_session)]
 
+async def upload_digest(doc: TrainingDocsModel) -> str:
+    # the digest sent by the client is only a hint: it is trusted when the
+    # upload is the content store object of that name, otherwise the file is
+    # hashed here and a different client digest is rejected
+    path = UPLOAD_DIR + f"/{doc.filename}"
+    if doc.digest and is_stored_as(path, doc.digest):
+        return doc.digest
+
+    digest = await asyncio.to_thread(sha256_file, path)
+    if doc.digest and doc.digest.lower() != digest:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Digest mismatch for {doc.filename}")
+    return digest
+
 @admin_router.post("/train/docs")
 async def training_documents(doc: TrainingDocsModel, session: SessionDep):
     upload_file_path = UPLOAD_DIR + f"/{doc.filename}"
     if not os.path.exists(upload_file_path):
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail="File not found!")
-    
-    content = convert_to_markdown(upload_file_path)
-    doc = TrainingDocs(mime_type=doc.mime_type, status=TrainingStatus.completed, size=doc.size, file_name=doc.filename, character_count=len(content))
+
+    doc = TrainingDocs(mime_type=doc.mime_type, status=TrainingStatus.pending, size=doc.size, file_name=doc.filename, content_hash=await upload_digest(doc))
 
     session.add(doc)
     session.commit()
     session.refresh(doc)
 
-    with open(f"{PROCESSED_DIR}/{str(doc.id)}.md", "w") as file:
-        file.write(content)
-    file.close()
-
-    cromadb.upsert(
-        documents=[content],
-        documentId=str(doc.id),
-    )
+    job_queue.enqueue(session, JobKind.document, doc.id)
+    session.refresh(doc)
 
     return doc
 
+@admin_router.post("/train/docs/batch")
+async def training_documents_batch(batch: TrainingDocsBatchModel, session: SessionDep):
+    missing = [doc.filename for doc in batch.docs if not os.path.exists(UPLOAD_DIR + f"/{doc.filename}")]
+    if missing:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Files not found: {', '.join(missing)}")
+
+    digests = await asyncio.gather(*[upload_digest(doc) for doc in batch.docs])
+    docs = [
+        TrainingDocs(mime_type=doc.mime_type, status=TrainingStatus.pending, size=doc.size, file_name=doc.filename, content_hash=digest)
+        for doc, digest in zip(batch.docs, digests)
+    ]
+    session.add_all(docs)
+    session.commit()
+
+    job = job_queue.enqueue(session, JobKind.document_batch, payload={"doc_ids": [doc.id for doc in docs]})
+    for doc in docs:
+        session.refresh(doc)
+
+    return {"job": job, "docs": docs}
+
 @admin_router.get("/train/docs")
 async def get_docs(session: SessionDep):
     docs = session.exec(select(TrainingDocs)).fetchall()
@@ -52,7 +88,8 @@ async def get_docs(session: SessionDep):
 
 @admin_router.delete("/train/docs/{docId}")
 async def remove_doc(docId: str, session: SessionDep):
-    cromadb.delete([docId])
+    # deleting may re-ingest documents that deferred to its chunks
+    await run_blocking(cromadb.delete, [docId])
 
     statement = select(TrainingDocs).where(TrainingDocs.id == uuid.UUID(docId))
     doc = session.exec(statement).one_or_none()
@@ -66,6 +103,9 @@ async def remove_doc(docId: str, session: SessionDep):
     if os.path.exists(upload_file_path):
         os.remove(upload_file_path)
 
+    if doc.content_hash:
+        release_object(doc.content_hash)
+
     if os.path.exists(processed_file_path):
         os.remove(processed_file_path)
 
@@ -77,34 +117,48 @@ async def remove_doc(docId: str, session: SessionDep):
 @admin_router.post("/train/websites")
 async def training_website(website: TrainingWebsiteModel, session: SessionDep):
     statement = select(TrainingWebsite).where(TrainingWebsite.url == website.url)
-    existsing = session.exec(statement).one_or_none()
+    existsing = session.exec(statement).first()
 
-    if existsing:
+    if existsing and not can_resume_website(existsing):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="website already crawled")
-    
-    websites = await crawl_website(website.url)
 
-    main_website = TrainingWebsite(url=website.url, status=TrainingStatus.completed, character_count=len(websites[0]['content']))
+    main_website = existsing or TrainingWebsite(url=website.url)
+    main_website.status = TrainingStatus.pending
+
     session.add(main_website)
     session.commit()
     session.refresh(main_website)
 
-    with open(f"{PROCESSED_DIR}/{str(main_website.id)}.md", "w") as file:
-        file.write(websites[0]['content'])
-    file.close()
+    job_queue.enqueue(session, JobKind.website, main_website.id, {"max_depth": website.max_depth, "max_pages": website.max_pages})
+    session.refresh(main_website)
 
-    cromadb.upsert(documents=[websites[0]['content']], documentId=str(main_website.id))
-    for w in websites[1:]:
-        new_website = TrainingWebsite(url=w['link'], parent_id=main_website.id, status=TrainingStatus.completed, character_count=len(w['content']))
-        session.add(new_website)
-        session.commit()
+    return main_website
 
-        cromadb.upsert(documents=[w['content']], documentId=str(new_website.id))
-        with open(f"{PROCESSED_DIR}/{str(new_website.id)}.md", "w") as file:
-            file.write(w['content'])
-        file.close()
+@admin_router.post("/train/websites/{websiteId}/recrawl")
+async def recrawl_website(websiteId: str, session: SessionDep):
+    website_id = uuid.UUID(websiteId)
+    statement = select(TrainingWebsite.id).where(or_(TrainingWebsite.id == website_id, TrainingWebsite.parent_id == website_id))
+    website_ids = session.exec(statement).fetchall()
 
-    return websites
+    if not website_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Website not found!")
+
+    return job_queue.enqueue(session, JobKind.recrawl, website_id, {"website_ids": website_ids})
+
+@admin_router.get("/jobs")
+async def get_jobs(session: SessionDep):
+    statement = select(IngestionJobs).order_by(IngestionJobs.created_at.desc()).limit(100)
+    jobs = session.exec(statement).fetchall()
+
+    return jobs
+
+@admin_router.get("/jobs/{jobId}")
+async def get_job(jobId: str, session: SessionDep):
+    job = session.get(IngestionJobs, uuid.UUID(jobId))
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found!")
+
+    return job
 
 @admin_router.get("/train/websites")
 async def get_websites(session: SessionDep):
@@ -114,13 +168,21 @@ async def get_websites(session: SessionDep):
 
 @admin_router.delete("/train/websites/{websiteId}")
 async def remove_website(websiteId: str, session: SessionDep):
-    cromadb.delete(ids=[websiteId])
+    # a crawl or recrawl still running would keep storing pages of the site
+    website_id = uuid.UUID(websiteId)
+    await job_queue.cancel(website_id)
 
-    processed_file_path = f"{PROCESSED_DIR}/{websiteId}.md"
-    if os.path.exists(processed_file_path):
-        os.remove(processed_file_path)
+    statement = select(TrainingWebsite.id).where(or_(TrainingWebsite.id == website_id, TrainingWebsite.parent_id == website_id))
+    website_ids = [str(id) for id in session.exec(statement).fetchall()]
+
+    await run_blocking(cromadb.delete, website_ids)
+    for id in website_ids:
+        processed_file_path = f"{PROCESSED_DIR}/{id}.md"
+        if os.path.exists(processed_file_path):
+            os.remove(processed_file_path)
+    await run_blocking(CrawlFrontier.discard, websiteId)
 
-    statement = delete(TrainingWebsite).where(TrainingWebsite.id == uuid.UUID(websiteId))
+    statement = delete(TrainingWebsite).where(or_(TrainingWebsite.id == website_id, TrainingWebsite.parent_id == website_id))
 
     session.exec(statement)
     session.commit()
@@ -228,9 +290,16 @@ async def get_conversation_messages(conversationId: str, session: SessionDep):
     return conversation_info
 
 @admin_router.post("/testing")
-async def chat_testing(payload: AdminChatTesting):
+async def chat_testing(payload: AdminChatTesting, request: Request):
+    async def event_generator():
+        try:
+            async for chunk in cancel_on_disconnect(request, chat_with_gemini_stream(payload.message, bounded_history(payload.history))):
+                yield chunk
+        except ClientDisconnected:
+            generation_stats["client_disconnects"] += 1
+
     return StreamingResponse(
-        chat_with_gemini_stream(payload.message, payload.history),
+        event_generator(),
         media_type="text/event-stream"
     )
 
@@ -250,3 +319,20 @@ async def admin_dashboard(session: SessionDep):
     }
 
     return result
+
+@admin_router.get("/metrics")
+async def admin_metrics():
+    return {
+        "crawler_pool": crawler_pool.stats(),
+        "crawl_cache": crawl_cache.stats(),
+        "site_crawl_cache": site_cache.stats(),
+        "site_crawl": discovery_stats,
+        "recrawl": recrawl_stats,
+        "vectors": cromadb.metrics(),
+        "query_cache": query_cache_stats(),
+        "retrieval_batcher": retrieval_batcher.metrics(),
+        "conversation_memory": conversation_memory.metrics(),
+        "titles": title_generator.metrics(),
+        "user_events": user_events.metrics(),
+        "generation": generation_stats,
+    }
@@ -1,14 +1,20 @@
+import asyncio
 import json
 import uuid
 from typing import Annotated
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.responses import StreamingResponse 
-from sqlmodel import Session, select, delete, update
+from sqlmodel import Session, select, delete, func
 
 from core.schema import CreateChatMessageModel, ConversationRenameModel, UserChatMessagesModel
-from core.db import get_session
+from core.db import engine, get_session
 from core.db.models import Conversations, ChatMessages
-from services.chat_with_gemini import chat_with_gemini, chat_with_gemini_stream
+from core.config import TITLE_AFTER_MESSAGES
+from helpers.streaming import cancel_on_disconnect, ClientDisconnected
+from services.chat_with_gemini import chat_with_gemini_stream, generation_stats
+from services.conversation_memory import conversation_memory
+from services.events import user_events
+from services.titles import title_generator, DEFAULT_TITLE
 
 chat_router = APIRouter(prefix="/chat")
 
@@ -20,17 +26,29 @@ def is_valid_uuid(val):
     except:
         return False
 
-def add_chat_messege_to_db(session: Session, conversation_id: str, botResponse: str):
+def add_chat_messege_to_db(conversation_id: str, botResponse: str):
     if not botResponse:
         return
 
-    botMesssage = ChatMessages(conversation_id=conversation_id, sender="assistant", content=botResponse)
-    session.add(botMesssage)
-    session.commit()
-    session.refresh(botMesssage)
+    with Session(engine) as session:
+        botMesssage = ChatMessages(conversation_id=conversation_id, sender="assistant", content=botResponse)
+        session.add(botMesssage)
+        session.commit()
+        session.refresh(botMesssage)
 
     return botMesssage
 
+def save_partial_answer(conversation_id: str, botResponse: str):
+    """Store what was streamed before the client went away.
+
+    Runs on the default executor without being awaited, since the request
+    task may already be cancelled.
+    """
+    generation_stats["client_disconnects"] += 1
+    if botResponse:
+        generation_stats["partial_answers_saved"] += 1
+        asyncio.get_running_loop().run_in_executor(None, add_chat_messege_to_db, conversation_id, botResponse)
+
 @chat_router.post("")
 async def create_chat(chat: CreateChatMessageModel, session: SessionDep, request: Request, background_tasks: BackgroundTasks):
     user_ctx = request.state.user
@@ -40,7 +58,7 @@ async def create_chat(chat: CreateChatMessageModel, session: SessionDep, request
             status_code=status.HTTP_400_BAD_REQUEST
         )
     
-    conversation = Conversations(user_id=user_ctx.id, title="New Chat")
+    conversation = Conversations(user_id=user_ctx.id, title=DEFAULT_TITLE)
     session.add(conversation)
     session.commit()
     session.refresh(conversation)
@@ -56,16 +74,23 @@ async def create_chat(chat: CreateChatMessageModel, session: SessionDep, request
     session.commit()
     session.refresh(userMessage)
 
-    def event_generator(conversationId):
+    async def event_generator(conversationId):
         yield json.dumps({"conversationId": str(conversationId)})
 
         full_response = ""
-        for chunk in chat_with_gemini_stream(chat.message):
-            text = chunk
-            full_response += text
-            yield text
-
-        background_tasks.add_task(add_chat_messege_to_db, session, conversation.id, full_response)
+        try:
+            async for chunk in cancel_on_disconnect(request, chat_with_gemini_stream(chat.message)):
+                text = chunk
+                full_response += text
+                yield text
+        except ClientDisconnected:
+            save_partial_answer(conversationId, full_response)
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            save_partial_answer(conversationId, full_response)
+            raise
+
+        background_tasks.add_task(add_chat_messege_to_db, conversationId, full_response)
 
     return StreamingResponse(
         event_generator(conversation.id),
@@ -98,25 +123,37 @@ async def conversation_chat(conversationId: str, chat: UserChatMessagesModel, se
             detail="not allowed"
         )
     
+    summary, history = conversation_memory.load(session, conversation)
+    needs_title = False
+    if conversation.title == DEFAULT_TITLE:
+        message_count = session.exec(
+            select(func.count()).select_from(ChatMessages).where(ChatMessages.conversation_id == conversation.id)
+        ).one()
+        needs_title = message_count + 2 >= TITLE_AFTER_MESSAGES
+
     userMessage = ChatMessages(conversation_id=conversation.id, sender="user", content=chat.message)
 
     session.add(userMessage)
     session.commit()
     session.refresh(userMessage)
 
-    if len(chat.history) == 4:
-        title = chat_with_gemini(chat.message, chat.history)
-        statement = update(Conversations).where(Conversations.id == conversationId).values(title=title)
-        session.exec(statement)
-        session.commit()    
-
-    def event_generator():
+    async def event_generator():
         full_response = ""
-        for chunk in chat_with_gemini_stream(chat.message, chat.history):
-            full_response += chunk
-            yield chunk
-
-        background_tasks.add_task(add_chat_messege_to_db, session, conversationId, full_response)
+        try:
+            async for chunk in cancel_on_disconnect(request, chat_with_gemini_stream(chat.message, history, summary)):
+                full_response += chunk
+                yield chunk
+        except ClientDisconnected:
+            save_partial_answer(conversationId, full_response)
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            save_partial_answer(conversationId, full_response)
+            raise
+
+        background_tasks.add_task(add_chat_messege_to_db, conversationId, full_response)
+        background_tasks.add_task(conversation_memory.refresh, conversationId)
+        if needs_title:
+            background_tasks.add_task(title_generator.schedule, conversationId, userctx.id)
 
     return StreamingResponse(
         event_generator(),
@@ -159,6 +196,16 @@ async def fetch_conversations(session: SessionDep, request: Request):
 
     return conversations
 
+@chat_router.get("/events")
+async def user_event_stream(request: Request):
+    userctx = request.state.user
+
+    return StreamingResponse(
+        user_events.stream(userctx.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
 @chat_router.get("/{conversationId}")
 async def conversation_messages(conversationId: str, session: SessionDep, request: Request):
     userctx = request.state.user
@@ -1,10 +1,13 @@
-import os, mimetypes, time
+import os, mimetypes, time, hashlib, shutil, asyncio, re, tempfile
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import BinaryIO, List, Optional
 
-from fastapi import APIRouter, File, Form, status, UploadFile
+from fastapi import APIRouter, File, Form, HTTPException, status, UploadFile
 from fastapi.responses import JSONResponse
 
-from core.config import CHUNKS_DIR, UPLOAD_DIR, PROCESSED_DIR
+from core.config import CHUNKS_DIR, UPLOAD_DIR, PROCESSED_DIR, UPLOAD_MAX_CHUNKS
+from services.content_store import store_object
 
 Path(CHUNKS_DIR).mkdir(exist_ok=True, parents=True)
 Path(UPLOAD_DIR).mkdir(exist_ok=True)
@@ -12,63 +15,194 @@ Path(PROCESSED_DIR).mkdir(exist_ok=True)
 
 upload_router = APIRouter()
 
-def rename_file(path_str: str) -> str:
-    path = Path(path_str)
+COPY_BLOCK_SIZE = 1024 * 1024
+UPLOAD_ID = re.compile(r"^[0-9a-f]{64}$")
+upload_locks: dict[str, list] = {}
 
-    if not path.is_file():
-        raise FileNotFoundError("File not found")
+class ChecksumMismatch(Exception):
+    pass
 
-    new_name = f"{path.stem.replace(' ', '_')}_{int(time.time())}{path.suffix}"
-    new_path = path.parent / new_name
+def upload_filename(name: str) -> str:
+    path = Path(name)
+    return f"{path.stem.replace(' ', '_')}_{int(time.time())}{path.suffix}"
 
-    path.rename(new_path)
-    return new_name
+def check_upload(upload_id: str, total_chunks: int, chunk_number: Optional[int] = None):
+    """Reject ids that are not a sha256 hex digest and chunk counts outside the allowed range."""
+    if not UPLOAD_ID.match(upload_id):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid upload id")
+    if not 1 <= total_chunks <= UPLOAD_MAX_CHUNKS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid total chunks")
+    if chunk_number is not None and not 1 <= chunk_number <= total_chunks:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid chunk number")
+
+def upload_id_for(chunk_digests: List[str]) -> str:
+    """An upload's id: sha256 of its chunks' sha256 hex digests, concatenated in order."""
+    return hashlib.sha256("".join(chunk_digests).encode()).hexdigest()
+
+@asynccontextmanager
+async def upload_lock(upload_id: str):
+    # the entry lives only while a request for the upload holds or waits on
+    # it, so uploads that are never finished do not leave locks behind
+    entry = upload_locks.setdefault(upload_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            upload_locks.pop(upload_id, None)
+
+def chunk_dir(upload_id: str) -> Path:
+    return Path(CHUNKS_DIR) / upload_id
+
+def received_chunks(upload_id: str, total_chunks: int) -> List[int]:
+    directory = chunk_dir(upload_id)
+    return [number for number in range(1, total_chunks + 1) if (directory / str(number)).is_file()]
+
+def write_chunk(source: BinaryIO, upload_id: str, chunk_number: int, checksum: str) -> str:
+    """Stream an uploaded chunk to disk block by block, verifying its sha256 when given.
+
+    The chunk is written to a temporary file of its own and only moved into
+    place once it is complete and verified, so a present chunk file is always
+    a good one, and a retried or resent chunk never writes into another
+    request's file.
+    """
+    directory = chunk_dir(upload_id)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=f"{chunk_number}.", suffix=".part", delete=False) as buffer:
+        part_path = Path(buffer.name)
+        try:
+            while block := source.read(COPY_BLOCK_SIZE):
+                digest.update(block)
+                buffer.write(block)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+
+    if digest.hexdigest() != checksum.lower():
+        part_path.unlink(missing_ok=True)
+        raise ChecksumMismatch(f"chunk {chunk_number} checksum mismatch")
+
+    os.replace(part_path, directory / str(chunk_number))
+    return digest.hexdigest()
+
+def copy_into(source: Path, output: BinaryIO):
+    """Append source to output, letting the kernel copy the bytes where it can."""
+    output.flush()
+    with open(source, "rb") as infile:
+        size = os.fstat(infile.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                sent = os.copy_file_range(infile.fileno(), output.fileno(), size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except (AttributeError, OSError):
+            if copied:
+                raise
+            shutil.copyfileobj(infile, output, COPY_BLOCK_SIZE)
+            output.flush()
+        output.seek(0, os.SEEK_END)
+
+def hash_into(path: Path, digest) -> str:
+    """Feed the file at path into digest and return the file's own sha256."""
+    own = hashlib.sha256()
+    with open(path, "rb") as infile:
+        while block := infile.read(COPY_BLOCK_SIZE):
+            digest.update(block)
+            own.update(block)
+    return own.hexdigest()
+
+def assemble_upload(upload_id: str, name: str, total_chunks: int, checksum: Optional[str]) -> dict:
+    directory = chunk_dir(upload_id)
+    assembled_path = directory / "assembled"
+    digest = hashlib.sha256()
+    chunk_digests = []
+
+    with open(assembled_path, "wb") as buffer:
+        for chunk in range(1, total_chunks + 1):
+            chunk_file = directory / str(chunk)
+            chunk_digests.append(hash_into(chunk_file, digest))
+            copy_into(chunk_file, buffer)
+
+    if upload_id_for(chunk_digests) != upload_id:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise ChecksumMismatch("upload id does not match the uploaded chunks")
+
+    if checksum and digest.hexdigest() != checksum.lower():
+        shutil.rmtree(directory, ignore_errors=True)
+        raise ChecksumMismatch("file checksum mismatch")
+
+    filename = upload_filename(name)
+    upload_path = f"{Path(UPLOAD_DIR)}/{filename}"
+    os.replace(assembled_path, upload_path)
+    shutil.rmtree(directory, ignore_errors=True)
+
+    mime_type, _ = mimetypes.guess_type(upload_path)
+    size = os.path.getsize(upload_path)
+    duplicate = store_object(upload_path, digest.hexdigest())
+
+    return {
+        "size": size,
+        "filename": filename,
+        "mime_type": mime_type,
+        "digest": digest.hexdigest(),
+        "duplicate": duplicate,
+    }
+
+@upload_router.get("/upload/files/chunks")
+async def get_received_chunks(upload_id: str, total_chunks: int):
+    check_upload(upload_id, total_chunks)
+    received = await asyncio.to_thread(received_chunks, upload_id, total_chunks)
+
+    return {
+        "upload_id": upload_id,
+        "received": received,
+        "missing": sorted(set(range(1, total_chunks + 1)) - set(received)),
+    }
 
 @upload_router.post("/upload/files")
 async def upload_chunk_files(
     file: UploadFile = File(...),
     name: str = Form(...),
+    upload_id: str = Form(...),
     chunk_number: int = Form(...),
-    total_chunks: int = Form(...)
+    total_chunks: int = Form(...),
+    chunk_sha256: str = Form(...),
+    sha256: Optional[str] = Form(None),
 ):
-    isLast = (int(chunk_number)) == int(
-        total_chunks
-    )
+    check_upload(upload_id, total_chunks, chunk_number)
 
-    file_name = f"{name}_{chunk_number}"
-    chunk_path = f"{Path(CHUNKS_DIR)}/{file_name}"
-
-    with open(chunk_path, "wb") as buffer:
-        buffer.write(await file.read())
-    buffer.close()
-
-    if isLast:
-        upload_path = f"{Path(UPLOAD_DIR)}/{name}"
-        with open(upload_path, "wb") as buffer:
-            chunk = 1
-            while chunk <= total_chunks:
-                chunk_file = f"{Path(CHUNKS_DIR)}/{name}_{chunk}"
-                with open(chunk_file, "rb") as infile:
-                    buffer.write(infile.read())
-                    infile.close()
-                os.remove(chunk_file)
-                chunk += 1
-        buffer.close()
-
-        mime_type, _ = mimetypes.guess_type(upload_path)
-
-        return JSONResponse(
-            {
-                "success": True, 
-                "isComplete": True, 
-                "size": os.path.getsize(upload_path), 
-                "filename": rename_file(upload_path), 
-                "mime_type": mime_type,
-                "message": "File Uploaded"
-            }, 
-            status_code=status.HTTP_200_OK
-        )
+    try:
+        await asyncio.to_thread(write_chunk, file.file, upload_id, chunk_number, chunk_sha256)
+    except ChecksumMismatch as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+    # chunks may arrive out of order or be re-sent, so the upload is complete
+    # once every chunk is on disk rather than when the last number arrives
+    async with upload_lock(upload_id):
+        received = await asyncio.to_thread(received_chunks, upload_id, total_chunks)
+        if len(received) < total_chunks:
+            return JSONResponse(
+                {"success": True, "isComplete": False, "received": len(received), "message": "Chunk Uploaded"},
+                status_code=status.HTTP_200_OK
+            )
+
+        try:
+            result = await asyncio.to_thread(assemble_upload, upload_id, name, total_chunks, sha256)
+        except ChecksumMismatch as e:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
 
     return JSONResponse(
-        {"success": True, "isComplete": False, "message": "Chunk Uploaded"}, status_code=status.HTTP_200_OK
-    )
\ No newline at end of file
+        {
+            "success": True,
+            "isComplete": True,
+            **result,
+            "message": "File Uploaded"
+        },
+        status_code=status.HTTP_200_OK
+    )
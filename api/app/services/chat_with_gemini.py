@@ -2,125 +2,141 @@ import json
 from typing import Optional, Literal, List, TypedDict
 
 import asyncio
+from contextlib import aclosing
 from google import genai
 from google.genai import types
 
 from services.rag.retriever import ChromaDBManager
-from core.config import GEMINI_API_KEY
-from .crawler import extractor, crawl_and_stream_urls
+from services.rag.batcher import QueryBatcher
+from services.rag.context import assemble_context
+from core.config import GEMINI_API_KEY, CONTEXT_CANDIDATES
+from .crawler import extractor, crawl_urls_as_completed
 
 client = genai.Client(api_key=GEMINI_API_KEY)
 
 GEMINI_MODEL = 'gemini-2.0-flash-001'
 chromadb = ChromaDBManager()
+retrieval_batcher = QueryBatcher(chromadb)
+
+generation_stats = {
+    "streams": 0,
+    "completed": 0,
+    "cancelled_before_answer": 0,
+    "cancelled_during_answer": 0,
+    "crawls_cancelled": 0,
+    "answer_chars": 0,
+    "partial_answer_chars": 0,
+    "client_disconnects": 0,
+    "partial_answers_saved": 0,
+}
 
 class HistoryItem(TypedDict):
     role: Literal['user', 'assistant']
     content: str
 
-def chat_with_gemini(message: str, history: Optional[List[HistoryItem]] = None):
-    userContent = types.Content(
-        role='user',
-        parts=[types.Part.from_text(text=message + "\n\n `Based on this conversation, generate a 3-5 word clean text title that must clearly mention the main topic or theme.`")]
-    )
-    
+def history_contents(history: Optional[List[HistoryItem]], summary: Optional[str] = None) -> List[types.Content]:
     contents = []
-    for item in history:
+    if summary:
+        contents.append(
+            types.Content(
+                role='user',
+                parts=[types.Part.from_text(text=f"Summary of our earlier conversation: {summary}")]
+            )
+        )
+
+    for item in history or []:
         contents.append(
             types.Content(
-                role=item.role if item.role == 'assistant' else 'user',
+                role='model' if item.role == 'assistant' else 'user',
                 parts=[types.Part.from_text(text=item.content)]
             )
         )
+    return contents
 
-    contents.append(userContent)    
-    response = client.models.generate_content(
-        model=GEMINI_MODEL,
-        config=types.GenerateContentConfig(
-            system_instruction="You are a conversation analyzer that generates relevant conversation title in clean text.",
-            max_output_tokens=15,
-        ),
-        contents=contents
-    )
-    return response.text
-
-def chat_with_gemini_stream(message: str, history: Optional[List[HistoryItem]] = None):
+async def chat_with_gemini_stream(message: str, history: Optional[List[HistoryItem]] = None, summary: Optional[str] = None):
+    """Stream crawl progress and then the answer.
+
+    If the consumer stops early (the generator is closed or its task
+    cancelled) the crawls still running and the Gemini stream are cancelled
+    with it, and the work avoided is counted in generation_stats.
+    """
     urls = extractor.find_urls(message)
     scrapped_data = []
     completed_urls = []
+    stream = None
+    generated = 0
 
-    if len(urls) > 0:
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        for url in urls:
-            async def process_single_url():
-                try:
-                    text = await crawl_and_stream_urls(url)
-                    completed_urls.append(url)
+    generation_stats["streams"] += 1
+    try:
+        async with aclosing(crawl_urls_as_completed(urls)) as crawls:
+            async for url, text, error in crawls:
+                if error:
+                    print(f"Error crawling {url}: {error}")
+                    result = f"Error processing {url}"
+                else:
+                    result = text
                     scrapped_data.append(text)
-                    return text
-                except Exception as e:
-                    print(f"Error crawling {url}: {e}")
-                    return f"Error processing {url}"
-            
-            result = loop.run_until_complete(process_single_url())
-            
-            yield json.dumps({
-                "urls_config": {
-                    "inProgress": len(completed_urls) < len(urls),
-                    "completed_urls": completed_urls,
-                    "urls": urls
-                },
-                "text": result
-            })
+                completed_urls.append(url)
 
-    contents = []
-    if history:
-        for item in history:
-            contents.append(
-                types.Content(
-                    role=item.role if item.role == 'assistant' else 'user',
-                    parts=[types.Part.from_text(text=item.content)]
-                )
+                yield json.dumps({
+                    "urls_config": {
+                        "inProgress": len(completed_urls) < len(urls),
+                        "completed_urls": completed_urls,
+                        "urls": urls
+                    },
+                    "text": result
+                })
+
+        contents = history_contents(history, summary)
+        context = assemble_context(await retrieval_batcher.query(message, CONTEXT_CANDIDATES))
+
+        prompt = (
+            """
+            You are a helpful and informative bot that answers questions using
+            text from the reference passage included below.
+            Be sure to respond in a complete sentence, being comprehensive,
+            including all relevant background information.
+            However, you are talking to a non-technical audience, so be sure to
+            break down complicated concepts and strike a friendly
+            and converstional tone. If the passage is irrelevant to the answer,
+            you may ignore it.
+            QUESTION: '{query}'
+            PASSAGE: '{relevant_passage}'
+
+            ANSWER:
+            """
+        ).format(query=message, relevant_passage=context)
+
+        contents.append(
+            types.Content(
+                role='user',
+                parts=[types.Part.from_text(text='\n'.join(scrapped_data) if urls else prompt)]
             )
+        )
 
-    context = chromadb.query(query_texts=[message])[0]
-    context = '\n'.join(context) if isinstance(context, list) else context
-
-    prompt = (
-        """
-        You are a helpful and informative bot that answers questions using
-        text from the reference passage included below.
-        Be sure to respond in a complete sentence, being comprehensive,
-        including all relevant background information.
-        However, you are talking to a non-technical audience, so be sure to
-        break down complicated concepts and strike a friendly
-        and converstional tone. If the passage is irrelevant to the answer,
-        you may ignore it.
-        QUESTION: '{query}'
-        PASSAGE: '{relevant_passage}'
-
-        ANSWER:
-        """
-    ).format(query=message, relevant_passage=context)
-
-    contents.append(
-        types.Content(
-            role='user',
-            parts=[types.Part.from_text(text=scrapped_data if urls else prompt)]
+        stream = await client.aio.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            config=types.GenerateContentConfig(
+                system_instruction= "You are a helpful assistant",
+                temperature=0.7,
+            ),
+            contents = contents
         )
-    )
-    
-    for chunk in client.models.generate_content_stream(
-        model=GEMINI_MODEL,
-        config=types.GenerateContentConfig(
-            system_instruction= "You are a helpful assistant",
-            temperature=0.7,
-        ),
-        contents = contents
-    ):
-        yield chunk.text
+        async for chunk in stream:
+            if chunk.text:
+                generated += len(chunk.text)
+                yield chunk.text
+
+        generation_stats["completed"] += 1
+    except (asyncio.CancelledError, GeneratorExit):
+        if stream is None:
+            generation_stats["cancelled_before_answer"] += 1
+            generation_stats["crawls_cancelled"] += len(urls) - len(completed_urls)
+        else:
+            generation_stats["cancelled_during_answer"] += 1
+            generation_stats["partial_answer_chars"] += generated
+        raise
+    finally:
+        generation_stats["answer_chars"] += generated
+        if stream is not None:
+            await stream.aclose()
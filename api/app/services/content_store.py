@@ -0,0 +1,51 @@
+import os
+import re
+from pathlib import Path
+
+from core.config import OBJECTS_DIR
+
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+def object_path(digest: str) -> Path:
+    return Path(OBJECTS_DIR) / digest[:2] / digest
+
+def is_stored_as(path: str, digest: str) -> bool:
+    """Whether the file at path is the stored object for digest.
+
+    Objects are named by the hash computed on the server when the upload was
+    assembled, so a file linked to one needs no hashing to know its content.
+    """
+    if not SHA256_HEX.match(digest):
+        return False
+    try:
+        return os.path.samefile(path, object_path(digest))
+    except OSError:
+        return False
+
+def store_object(path: str, digest: str) -> bool:
+    """Add the file at path to the content-addressed store.
+
+    When the same content is already stored, the file at path is swapped for a
+    hard link to the stored copy so identical uploads share one copy on disk.
+    Returns True if the content was already known.
+    """
+    target = object_path(digest)
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        if target.exists():
+            link = f"{path}.link"
+            os.link(target, link)
+            os.replace(link, path)
+            return True
+
+        os.link(path, target)
+    except OSError as e:
+        print(f"Error adding {path} to the content store: {e}")
+    return False
+
+def release_object(digest: str):
+    """Drop a stored object once no upload links to it anymore."""
+    target = object_path(digest)
+    if target.exists() and target.stat().st_nlink <= 1:
+        target.unlink()
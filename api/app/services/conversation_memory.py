@@ -0,0 +1,156 @@
+import asyncio
+import uuid
+from typing import List, Optional, Tuple
+
+from google.genai import types
+from sqlmodel import Session, select, update
+
+from core.config import CHAT_HISTORY_MESSAGES, CHAT_HISTORY_TOKEN_BUDGET, CHAT_SUMMARY_BATCH, CHAT_SUMMARY_MAX_TOKENS
+from core.db import engine
+from core.db.models import Conversations, ChatMessages
+from core.schema import ChatHistoryItem
+from services.chat_with_gemini import client, GEMINI_MODEL
+from services.rag.context import CHARS_PER_TOKEN, estimate_tokens
+
+SUMMARY_MESSAGE_CHARS = CHAT_HISTORY_TOKEN_BUDGET * CHARS_PER_TOKEN // max(CHAT_SUMMARY_BATCH, 1)
+
+def bounded_history(history: Optional[List[ChatHistoryItem]], max_messages: int = CHAT_HISTORY_MESSAGES) -> List[ChatHistoryItem]:
+    """The newest messages of history (oldest first) that fit max_messages and CHAT_HISTORY_TOKEN_BUDGET.
+
+    The message that crosses the budget is cut short and nothing older is kept.
+    """
+    window, used = [], 0
+    for item in reversed((history or [])[-max_messages:]):
+        remaining = CHAT_HISTORY_TOKEN_BUDGET - used
+        if remaining <= 0:
+            break
+
+        content = item.content
+        if estimate_tokens(content) > remaining:
+            content = content[-remaining * CHARS_PER_TOKEN:]
+        window.append(ChatHistoryItem(role=item.role, content=content))
+        used += estimate_tokens(content)
+
+    window.reverse()
+    return window
+
+def messages_to_fold(token_counts: List[int]) -> int:
+    """How many of the oldest unsummarized messages to fold into the summary.
+
+    Nothing is folded while the unsummarized messages fit the history window.
+    Once they outgrow it, the oldest are folded until what is left fits
+    CHAT_HISTORY_MESSAGES - CHAT_SUMMARY_BATCH messages and half the token
+    budget, leaving room for the next turns before another summary is due.
+    """
+    if len(token_counts) <= CHAT_HISTORY_MESSAGES and sum(token_counts) <= CHAT_HISTORY_TOKEN_BUDGET:
+        return 0
+
+    keep, used = 0, 0
+    for tokens in reversed(token_counts):
+        if keep >= CHAT_HISTORY_MESSAGES - CHAT_SUMMARY_BATCH or used + tokens > CHAT_HISTORY_TOKEN_BUDGET // 2:
+            break
+        keep += 1
+        used += tokens
+    return len(token_counts) - keep
+
+class ConversationMemory:
+    """Conversation history read from the database instead of the client.
+
+    A prompt gets the conversation summary plus every message the summary
+    does not cover yet; summarized_count is how many messages (oldest first)
+    it covers. After each turn, once those messages outgrow the history
+    window, the oldest are folded into Conversations.summary, so every
+    message is always either in the summary or in the prompt.
+    """
+
+    def __init__(self):
+        self.refreshing: set = set()
+        self.stats = {"summaries": 0, "summarized_messages": 0, "failures": 0}
+
+    def unsummarized(self, session: Session, conversation: Conversations) -> List[ChatMessages]:
+        statement = (
+            select(ChatMessages)
+            .where(ChatMessages.conversation_id == conversation.id)
+            .order_by(ChatMessages.created_at, ChatMessages.id)
+            .offset(conversation.summarized_count)
+        )
+        return session.exec(statement).all()
+
+    def load(self, session: Session, conversation: Conversations) -> Tuple[Optional[str], List[ChatHistoryItem]]:
+        # summaries keep this at most a turn past the window; the cap only
+        # bites when summarizing has been failing
+        history = [
+            ChatHistoryItem(role=message.sender.value, content=message.content)
+            for message in self.unsummarized(session, conversation)
+        ]
+        return conversation.summary, bounded_history(history, 2 * CHAT_HISTORY_MESSAGES)
+
+    def _pending(self, conversation_id: uuid.UUID):
+        with Session(engine) as session:
+            conversation = session.get(Conversations, conversation_id)
+            if not conversation:
+                return None
+
+            messages = self.unsummarized(session, conversation)
+            fold = messages_to_fold([estimate_tokens(message.content) for message in messages])
+            if not fold:
+                return None
+
+            lines = [f"{message.sender.value}: {message.content[:SUMMARY_MESSAGE_CHARS]}" for message in messages[:fold]]
+            start = conversation.summarized_count
+            return conversation.summary, start, start + fold, lines
+
+    def _save(self, conversation_id: uuid.UUID, summary: str, start: int, end: int):
+        with Session(engine) as session:
+            session.exec(
+                update(Conversations)
+                .where(Conversations.id == conversation_id, Conversations.summarized_count == start)
+                .values(summary=summary, summarized_count=end)
+            )
+            session.commit()
+
+    async def summarize(self, summary: Optional[str], lines: List[str]) -> str:
+        prompt = (
+            f"SUMMARY SO FAR: '{summary or ''}'\n\n"
+            "NEW MESSAGES:\n" + "\n".join(lines) + "\n\n"
+            "Rewrite the summary so it also covers the new messages."
+        )
+        response = await client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            config=types.GenerateContentConfig(
+                system_instruction="You keep a short running summary of a conversation: facts, names, decisions and open questions. Reply with the summary only.",
+                max_output_tokens=CHAT_SUMMARY_MAX_TOKENS,
+            ),
+            contents=prompt
+        )
+        return (response.text or "").strip()
+
+    async def refresh(self, conversation_id: uuid.UUID):
+        """Fold the oldest unsummarized messages into the summary once they outgrow the history window."""
+        if conversation_id in self.refreshing:
+            return
+
+        self.refreshing.add(conversation_id)
+        try:
+            pending = await asyncio.to_thread(self._pending, conversation_id)
+            if pending is None:
+                return
+
+            summary, start, end, lines = pending
+            new_summary = await self.summarize(summary, lines)
+            if not new_summary:
+                return
+
+            await asyncio.to_thread(self._save, conversation_id, new_summary, start, end)
+            self.stats["summaries"] += 1
+            self.stats["summarized_messages"] += end - start
+        except Exception as e:
+            self.stats["failures"] += 1
+            print(f"Error summarizing conversation {conversation_id}: {e}")
+        finally:
+            self.refreshing.discard(conversation_id)
+
+    def metrics(self) -> dict:
+        return {**self.stats, "refreshing": len(self.refreshing)}
+
+conversation_memory = ConversationMemory()
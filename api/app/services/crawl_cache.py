@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+from core.config import CRAWL_CACHE_DIR, CRAWL_CACHE_TTL, CRAWL_CACHE_MAX_MB
+from helpers.urls import normalize_url
+from .http_client import get_http_client
+
+def header_value(headers: Optional[dict], name: str) -> Optional[str]:
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+PageCrawler = Callable[[str], Awaitable[Optional[dict]]]
+
+class CrawlCache:
+    """Extracted page markdown on local disk, keyed by profile and normalized url.
+
+    profile names the extraction settings the markdown was produced with, so
+    pages extracted differently never answer for each other. Entries older
+    than the ttl are revalidated with ETag / Last-Modified before being
+    crawled again, and the least recently used entries are evicted once the
+    cache grows past max_bytes. A page's links are kept on disk only, next to
+    its metadata.
+    """
+
+    def __init__(self, profile: str, cache_dir: str = CRAWL_CACHE_DIR, ttl: int = CRAWL_CACHE_TTL, max_bytes: int = CRAWL_CACHE_MAX_MB * 1024 * 1024):
+        self.profile = profile
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._index: "OrderedDict[str, dict]" = OrderedDict()
+        self._size = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._inflight: dict[str, dict] = {}
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(f"{self.profile}:{normalize_url(url)}".encode()).hexdigest()
+
+    def _paths(self, key: str):
+        folder = self.cache_dir / key[:2]
+        return folder / f"{key}.md", folder / f"{key}.json"
+
+    def _scan(self):
+        entries = []
+        for meta_path in self.cache_dir.glob("*/*.json"):
+            md_path = meta_path.with_suffix(".md")
+            try:
+                meta = json.loads(meta_path.read_text())
+                meta.pop("links", None)
+                meta["accessed_at"] = md_path.stat().st_mtime
+                entries.append(meta)
+            except (OSError, ValueError):
+                continue
+        return sorted(entries, key=lambda meta: meta["accessed_at"])
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+
+        async with self._load_lock:
+            if self._loaded:
+                return
+
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for meta in await asyncio.to_thread(self._scan):
+                self._index[meta["key"]] = meta
+                self._size += meta["size"]
+            self._loaded = True
+
+    def _read(self, key: str):
+        md_path, meta_path = self._paths(key)
+        os.utime(md_path)
+        return md_path.read_text(), json.loads(meta_path.read_text()).get("links") or []
+
+    def _write(self, meta: dict, markdown: str, links: List[str]):
+        md_path, meta_path = self._paths(meta["key"])
+        md_path.parent.mkdir(parents=True, exist_ok=True)
+        md_path.write_text(markdown)
+        meta_path.write_text(json.dumps({**meta, "links": links}))
+
+    def _remove(self, key: str):
+        for path in self._paths(key):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def _evict(self):
+        evicted = []
+        while self._size > self.max_bytes and self._index:
+            key, meta = self._index.popitem(last=False)
+            self._size -= meta["size"]
+            evicted.append(key)
+
+        for key in evicted:
+            await asyncio.to_thread(self._remove, key)
+
+    async def get(self, url: str) -> Optional[dict]:
+        await self._ensure_loaded()
+        key = self._key(url)
+        meta = self._index.get(key)
+        if not meta:
+            return None
+
+        try:
+            markdown, links = await asyncio.to_thread(self._read, key)
+        except (OSError, ValueError):
+            self._index.pop(key, None)
+            self._size -= meta["size"]
+            return None
+
+        self._index.move_to_end(key)
+        return {**meta, "markdown": markdown, "links": links}
+
+    async def put(self, url: str, markdown: str, title: Optional[str] = None, headers: Optional[dict] = None, links: Optional[List[str]] = None) -> dict:
+        await self._ensure_loaded()
+        key = self._key(url)
+        meta = {
+            "key": key,
+            "url": normalize_url(url),
+            "title": title,
+            "etag": header_value(headers, "etag"),
+            "last_modified": header_value(headers, "last-modified"),
+            "fetched_at": time.time(),
+            "size": len(markdown.encode()),
+        }
+        await asyncio.to_thread(self._write, meta, markdown, links or [])
+
+        previous = self._index.pop(key, None)
+        if previous:
+            self._size -= previous["size"]
+        self._index[key] = meta
+        self._size += meta["size"]
+
+        await self._evict()
+        return {**meta, "markdown": markdown, "links": links or []}
+
+    async def _touch(self, entry: dict):
+        meta = {k: v for k, v in entry.items() if k not in ("markdown", "links")}
+        meta["fetched_at"] = time.time()
+        _, meta_path = self._paths(meta["key"])
+        await asyncio.to_thread(meta_path.write_text, json.dumps({**meta, "links": entry["links"]}))
+        self._index[meta["key"]] = meta
+
+    async def _not_modified(self, entry: dict) -> bool:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        if not headers:
+            return False
+
+        try:
+            async with get_http_client().stream("GET", entry["url"], headers=headers) as response:
+                return response.status_code == 304
+        except Exception:
+            return False
+
+    async def fetch(self, url: str, crawl: PageCrawler) -> Optional[dict]:
+        """Return the cached page for url, crawling it with crawl(url) when stale or missing.
+
+        crawl returns a dict with content, title, headers and optionally links,
+        or None when the page could not be extracted.
+
+        Concurrent lookups of the same url share a single crawl, which is
+        cancelled once every caller waiting on it has gone away.
+        """
+        key = self._key(url)
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = asyncio.create_task(self._fetch(url, crawl))
+            inflight = self._inflight[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        inflight["waiters"] += 1
+        try:
+            return await asyncio.shield(inflight["task"])
+        finally:
+            inflight["waiters"] -= 1
+            if inflight["waiters"] == 0 and not inflight["task"].done():
+                inflight["task"].cancel()
+
+    async def _fetch(self, url: str, crawl: PageCrawler) -> Optional[dict]:
+        entry = await self.get(url)
+        if entry and time.time() - entry["fetched_at"] < self.ttl:
+            self.hits += 1
+            return entry
+
+        if entry and await self._not_modified(entry):
+            self.revalidated += 1
+            await self._touch(entry)
+            return entry
+
+        self.misses += 1
+        page = await crawl(url)
+        if not page:
+            return None
+
+        return await self.put(url, page["content"], title=page.get("title"), headers=page.get("headers"), links=page.get("links"))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "entries": len(self._index),
+            "size_bytes": self._size,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.revalidated) / lookups, 4) if lookups else 0.0,
+        }
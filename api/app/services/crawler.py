@@ -1,14 +1,33 @@
+import asyncio
+from typing import List
+
 from urlextract import URLExtract
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode, LXMLWebScrapingStrategy
-from crawl4ai.deep_crawling import BestFirstCrawlingStrategy
+from crawl4ai import BrowserConfig, CrawlerRunConfig, CacheMode, LXMLWebScrapingStrategy
+from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+
+from core.config import (
+    CRAWL_CONCURRENCY_PER_REQUEST, CRAWL_CONCURRENCY_GLOBAL, CRAWL_SITE_CONCURRENCY, INGEST_QUEUE_SIZE,
+    SITE_CRAWL_CACHE_DIR, SITE_CRAWL_CACHE_MAX_MB,
+)
+from .frontier import CrawlFrontier, HostLimiter
+from .discovery import NeedsBrowser, USER_AGENT, fetch_robots, fetch_static_page, sitemap_urls, stats as discovery_stats
+from .crawler_pool import CrawlerPool
+from .crawl_cache import CrawlCache
 
 extractor = URLExtract()
+global_crawl_limit = asyncio.Semaphore(CRAWL_CONCURRENCY_GLOBAL)
 
 browser_cfg = BrowserConfig(
     headless=True,
     text_mode=True,
 )
 
+crawler_pool = CrawlerPool(browser_cfg)
+# chat and training extract pages differently, so each gets its own cache
+# (and size budget): a training crawl never evicts pages chat users asked about
+crawl_cache = CrawlCache("chat")
+site_cache = CrawlCache("site", SITE_CRAWL_CACHE_DIR, max_bytes=SITE_CRAWL_CACHE_MAX_MB * 1024 * 1024)
+
 def get_configs(stream: bool = True):
     run_config = CrawlerRunConfig(
         cache_mode=CacheMode.BYPASS,
@@ -18,59 +37,161 @@ def get_configs(stream: bool = True):
     )
     return run_config
 
+async def crawl_page(url: str, config: CrawlerRunConfig = None):
+    async def crawl(url: str):
+        async with crawler_pool.crawler() as crawler:
+            result = await crawler.arun(url=url, config=config or get_configs(stream=False))
+
+        if not result.success or not result.markdown:
+            return None
+        return {
+            "content": str(result.markdown),
+            "title": (result.metadata or {}).get("title"),
+            "headers": result.response_headers,
+        }
+
+    return await crawl_cache.fetch(url, crawl)
+
 async def crawl_and_stream_urls(url: str):
-    async with AsyncWebCrawler(config=browser_cfg) as crawler:
-        result = await crawler.arun(
-            url=url,
-            config=get_configs()
-        )
-        return result.markdown[:300]
-
-def deep_crawl_configs() -> CrawlerRunConfig:
+    page = await crawl_page(url, get_configs())
+    if not page:
+        raise RuntimeError(f"could not crawl {url}")
+
+    return page["markdown"][:300]
+
+async def crawl_urls_as_completed(urls: List[str], concurrency: int = CRAWL_CONCURRENCY_PER_REQUEST):
+    """Crawl urls concurrently and yield (url, text, error) as each one finishes."""
+    request_limit = asyncio.Semaphore(concurrency)
+
+    async def crawl_one(url: str):
+        async with request_limit, global_crawl_limit:
+            try:
+                return url, await crawl_and_stream_urls(url), None
+            except Exception as e:
+                return url, None, e
+
+    tasks = [asyncio.create_task(crawl_one(url)) for url in urls]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def site_page_configs() -> CrawlerRunConfig:
     return CrawlerRunConfig(
-        excluded_tags=["img", "iframe"],
-        deep_crawl_strategy=BestFirstCrawlingStrategy(
-            max_depth=2,
-            include_external=False,
-            max_pages=5,
-        ),
+        cache_mode=CacheMode.BYPASS,
+        excluded_tags=["nav", "header", "footer", "aside", "script", "style", "img", "svg", "iframe"],
+        markdown_generator=DefaultMarkdownGenerator(options={"ignore_links": True, "ignore_images": True}),
         scraping_strategy=LXMLWebScrapingStrategy(),
-        verbose=True,
     )
 
-async def extract_urls(mainUrl: str):
-    async with AsyncWebCrawler() as crawler:
-        results = await crawler.arun(mainUrl, config=deep_crawl_configs())
-
-    print(f"Crawled {len(results)} pages in total")
-
-    links = []
-    for result in filter(lambda x: x != mainUrl, results):
-        if len(links) == 4:
-            break
-
-        url = result.url.rstrip("/")
-        if url not in [link.rstrip("/") for link in links]:
-            links.append(result.url)
-
-    return links
-
-
-async def crawl_website(url: str):
-    config = get_configs(stream=False)
-    links = await extract_urls(str(url))
-
-    website_metadata = []
-    for link in links:
-        async with AsyncWebCrawler() as crawler:
-            result = await crawler.arun(link, config=config)
-
-        if not result.success or not result.markdown:
-            return
-        
-        title = result.metadata.get("title")
-        content = result.markdown
-
-        website_metadata.append({"title": title, "content": content, "link": link})
-
-    return website_metadata
+async def fetch_browser_page(url: str):
+    async with crawler_pool.crawler() as crawler:
+        result = await crawler.arun(url=url, config=site_page_configs())
+
+    if not result.success or not result.markdown:
+        return None
+
+    discovery_stats["browser_pages"] += 1
+    return {
+        "title": (result.metadata or {}).get("title"),
+        "content": str(result.markdown),
+        "links": [link.get("href") for link in (result.links or {}).get("internal", []) if link.get("href")],
+        "headers": result.response_headers,
+    }
+
+async def fetch_site_page(url: str, limiter: HostLimiter):
+    """Return a training page from the site cache, or fetch it over plain HTTP,
+    falling back to the browser when it needs JavaScript.
+
+    Cached pages keep their links, so the crawl continues past a cache hit.
+    """
+    async def crawl(url: str):
+        await limiter.wait(url)
+        try:
+            try:
+                return await fetch_static_page(url)
+            except NeedsBrowser:
+                return await fetch_browser_page(url)
+        finally:
+            limiter.release(url)
+
+    try:
+        cached = await site_cache.fetch(url, crawl)
+    except Exception as e:
+        print(f"Error crawling {url}: {e}")
+        return None
+
+    if not cached:
+        return None
+
+    return {
+        "title": cached["title"],
+        "content": cached["markdown"],
+        "link": url,
+        "links": cached["links"],
+        "etag": cached["etag"],
+        "last_modified": cached["last_modified"],
+    }
+
+async def stream_site(frontier: CrawlFrontier, concurrency: int = CRAWL_SITE_CONCURRENCY):
+    """Crawl the urls queued in frontier and yield each page as soon as it has been rendered.
+
+    Pages that fail are marked in the frontier here; the caller marks a yielded
+    page complete once it has stored it, so a crash in between re-queues it.
+    """
+    robots = await fetch_robots(frontier.root_url)
+    limiter = HostLimiter()
+    limiter.delay = max(limiter.delay, robots.crawl_delay(USER_AGENT) or 0)
+
+    seeds = await sitemap_urls(frontier.root_url, robots, frontier.max_pages)
+    await asyncio.to_thread(frontier.add, seeds, 1)
+
+    pages: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    wakeup = asyncio.Event()
+    state = {"active": 0}
+
+    async def worker():
+        while True:
+            wakeup.clear()
+            rows = await asyncio.to_thread(frontier.claim, 1)
+            if not rows:
+                if state["active"] == 0:
+                    return
+                await wakeup.wait()
+                continue
+
+            url, depth = rows[0]
+            state["active"] += 1
+            try:
+                page = None
+                if depth == 0 or robots.can_fetch(USER_AGENT, url):
+                    page = await fetch_site_page(url, limiter)
+                if page:
+                    await asyncio.to_thread(frontier.add, page.pop("links"), depth + 1)
+                    await pages.put(page)
+                else:
+                    await asyncio.to_thread(frontier.complete, url, False)
+            finally:
+                state["active"] -= 1
+                wakeup.set()
+
+    async def run_workers():
+        try:
+            async with asyncio.TaskGroup() as group:
+                for _ in range(concurrency):
+                    group.create_task(worker())
+        except Exception as e:
+            await pages.put(e)
+        else:
+            await pages.put(None)
+
+    runner = asyncio.create_task(run_workers())
+    try:
+        while (page := await pages.get()) is not None:
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        runner.cancel()
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
+
+from core.config import CRAWLER_POOL_SIZE, CRAWLER_MAX_PAGES_PER_BROWSER, CRAWLER_HEALTHCHECK_INTERVAL
+
+HEALTHCHECK_URL = "raw:<html><body>ok</body></html>"
+
+class PooledCrawler:
+    """A warm browser handed out by CrawlerPool, counting the pages it renders."""
+
+    def __init__(self, crawler: AsyncWebCrawler):
+        self.crawler = crawler
+        self.pages = 0
+        self.last_checked = time.monotonic()
+        self.suspect = False
+
+    async def arun(self, url: str, config: CrawlerRunConfig = None, **kwargs):
+        result = await self.crawler.arun(url, config=config, **kwargs)
+        if hasattr(result, "__aiter__"):
+            return self._counted(result)
+
+        self.pages += len(result) if isinstance(result, list) else 1
+        return result
+
+    async def _counted(self, results):
+        async for result in results:
+            self.pages += 1
+            yield result
+
+class CrawlerPool:
+    def __init__(self, browser_config: BrowserConfig, size: int = CRAWLER_POOL_SIZE, max_pages: int = CRAWLER_MAX_PAGES_PER_BROWSER, healthcheck_interval: int = CRAWLER_HEALTHCHECK_INTERVAL):
+        self.browser_config = browser_config
+        self.size = size
+        self.max_pages = max_pages
+        self.healthcheck_interval = healthcheck_interval
+
+        self._idle: asyncio.Queue[PooledCrawler] = asyncio.Queue()
+        self._start_lock = asyncio.Lock()
+        self._started = False
+        self._background = set()
+
+        self._acquired = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recycled = 0
+        self._unhealthy = 0
+
+    async def _launch(self) -> PooledCrawler:
+        crawler = AsyncWebCrawler(config=self.browser_config)
+        await crawler.start()
+        return PooledCrawler(crawler)
+
+    async def start(self):
+        async with self._start_lock:
+            if self._started:
+                return
+
+            crawlers = await asyncio.gather(*[self._launch() for _ in range(self.size)])
+            for pooled in crawlers:
+                self._idle.put_nowait(pooled)
+            self._started = True
+
+    async def close(self):
+        async with self._start_lock:
+            self._started = False
+            for task in list(self._background):
+                task.cancel()
+
+            while not self._idle.empty():
+                pooled = self._idle.get_nowait()
+                await self._shutdown(pooled)
+
+    async def _shutdown(self, pooled: PooledCrawler):
+        try:
+            await pooled.crawler.close()
+        except Exception as e:
+            print(f"Error closing crawler: {e}")
+
+    async def _is_healthy(self, pooled: PooledCrawler) -> bool:
+        try:
+            result = await pooled.crawler.arun(HEALTHCHECK_URL, config=CrawlerRunConfig(cache_mode=CacheMode.BYPASS))
+            return bool(result.success)
+        except Exception:
+            return False
+
+    async def _replace(self, pooled: PooledCrawler) -> PooledCrawler:
+        await self._shutdown(pooled)
+        self._recycled += 1
+        return await self._launch()
+
+    async def _checked(self, pooled: PooledCrawler) -> PooledCrawler:
+        if not pooled.suspect and time.monotonic() - pooled.last_checked < self.healthcheck_interval:
+            return pooled
+
+        if not await self._is_healthy(pooled):
+            self._unhealthy += 1
+            pooled = await self._replace(pooled)
+
+        pooled.suspect = False
+        pooled.last_checked = time.monotonic()
+        return pooled
+
+    async def _release(self, pooled: PooledCrawler):
+        if pooled.pages >= self.max_pages:
+            try:
+                pooled = await self._replace(pooled)
+            except Exception as e:
+                print(f"Error recycling crawler: {e}")
+                pooled.suspect = True
+        self._idle.put_nowait(pooled)
+
+    @asynccontextmanager
+    async def crawler(self):
+        if not self._started:
+            await self.start()
+
+        started_at = time.monotonic()
+        pooled = await self._idle.get()
+        waited = time.monotonic() - started_at
+
+        self._acquired += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+        try:
+            pooled = await self._checked(pooled)
+        except BaseException:
+            pooled.suspect = True
+            self._idle.put_nowait(pooled)
+            raise
+
+        try:
+            yield pooled
+        except Exception:
+            pooled.suspect = True
+            raise
+        finally:
+            task = asyncio.create_task(self._release(pooled))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "acquired": self._acquired,
+            "wait_seconds_total": round(self._wait_total, 4),
+            "wait_seconds_avg": round(self._wait_total / self._acquired, 4) if self._acquired else 0.0,
+            "wait_seconds_max": round(self._wait_max, 4),
+            "recycled": self._recycled,
+            "unhealthy": self._unhealthy,
+        }
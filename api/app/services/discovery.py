@@ -0,0 +1,121 @@
+import asyncio
+import gzip
+import re
+from typing import List, Optional
+from urllib.parse import urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
+from xml.etree import ElementTree
+
+from bs4 import BeautifulSoup
+from markdownify import markdownify
+
+from core.config import STATIC_MIN_TEXT_CHARS
+from .http_client import get_http_client
+
+USER_AGENT = "WeChatAI"
+EXCLUDED_TAGS = ["nav", "header", "footer", "aside", "script", "style", "img", "svg", "iframe", "noscript", "form"]
+EMPTY_APP_ROOT = re.compile(r'<div[^>]+id=["\'](root|app|__next|__nuxt)["\'][^>]*>\s*</div>', re.IGNORECASE)
+NOSCRIPT_JS = re.compile(r"<noscript[^>]*>[^<]*(enable|requires?)\s+javascript", re.IGNORECASE)
+
+stats = {"static_pages": 0, "browser_pages": 0, "sitemap_urls": 0}
+
+class NeedsBrowser(Exception):
+    """The page has to be rendered by the headless browser."""
+
+def site_root(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+async def fetch_robots(url: str) -> RobotFileParser:
+    robots = RobotFileParser(urljoin(site_root(url), "/robots.txt"))
+    try:
+        response = await get_http_client().get(robots.url)
+    except Exception:
+        response = None
+
+    if response is not None and response.status_code == 200:
+        robots.parse(response.text.splitlines())
+    else:
+        robots.allow_all = True
+    return robots
+
+def parse_sitemap(content: bytes):
+    if content[:2] == b"\x1f\x8b":
+        content = gzip.decompress(content)
+
+    root = ElementTree.fromstring(content)
+    namespace = root.tag.split("}")[0] + "}" if root.tag.startswith("{") else ""
+    locations = [loc.text.strip() for loc in root.iter(f"{namespace}loc") if loc.text]
+    is_index = root.tag == f"{namespace}sitemapindex"
+    return is_index, locations
+
+async def sitemap_urls(url: str, robots: RobotFileParser, limit: int) -> List[str]:
+    """Page urls listed in the site's sitemaps (from robots.txt, else /sitemap.xml)."""
+    pending = list(robots.site_maps() or []) or [urljoin(site_root(url), "/sitemap.xml")]
+    seen_sitemaps = set()
+    urls = []
+
+    while pending and len(urls) < limit:
+        sitemap = pending.pop(0)
+        if sitemap in seen_sitemaps:
+            continue
+        seen_sitemaps.add(sitemap)
+
+        try:
+            response = await get_http_client().get(sitemap)
+            if response.status_code != 200:
+                continue
+            is_index, locations = await asyncio.to_thread(parse_sitemap, response.content)
+        except Exception as e:
+            print(f"Error reading sitemap {sitemap}: {e}")
+            continue
+
+        if is_index:
+            pending.extend(locations)
+        else:
+            urls.extend(locations[:limit - len(urls)])
+
+    stats["sitemap_urls"] += len(urls)
+    return urls
+
+def html_to_page(html: str, url: str) -> dict:
+    if EMPTY_APP_ROOT.search(html) or NOSCRIPT_JS.search(html):
+        raise NeedsBrowser(url)
+
+    soup = BeautifulSoup(html, "lxml")
+    links = [urljoin(url, a["href"]) for a in soup.find_all("a", href=True)]
+    title = soup.title.get_text(strip=True) if soup.title else None
+
+    for tag in soup(EXCLUDED_TAGS):
+        tag.decompose()
+
+    body = soup.body or soup
+    if len(body.get_text(" ", strip=True)) < STATIC_MIN_TEXT_CHARS:
+        raise NeedsBrowser(url)
+
+    content = markdownify(str(body), heading_style="ATX", strip=["a"])
+    content = re.sub(r"\n{3,}", "\n\n", content).strip()
+    return {"title": title, "content": content, "links": links}
+
+async def fetch_static_page(url: str) -> Optional[dict]:
+    """Fetch url over plain HTTP.
+
+    Returns None for responses that are not html pages, and raises NeedsBrowser
+    when the page looks like it relies on JavaScript to render its content.
+    """
+    try:
+        response = await get_http_client().get(url)
+    except Exception as e:
+        raise NeedsBrowser(url) from e
+
+    if response.status_code in (401, 403, 429) or response.status_code >= 500:
+        raise NeedsBrowser(url)
+    if response.status_code != 200:
+        return None
+    if "html" not in response.headers.get("content-type", ""):
+        return None
+
+    page = await asyncio.to_thread(html_to_page, response.text, str(response.url))
+    page["headers"] = dict(response.headers)
+    stats["static_pages"] += 1
+    return page
@@ -0,0 +1,58 @@
+import asyncio
+import json
+import uuid
+from collections import defaultdict
+from typing import Dict
+
+from core.config import USER_EVENT_QUEUE_SIZE
+
+class UserEvents:
+    """Per-user fan-out of server events to open /chat/events streams.
+
+    Each stream has its own bounded queue; events for a stream that is not
+    keeping up are dropped rather than buffered without limit.
+    """
+
+    def __init__(self, queue_size: int = USER_EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers: Dict[uuid.UUID, set] = defaultdict(set)
+        self.stats = {"published": 0, "delivered": 0, "dropped": 0}
+
+    def subscribe(self, user_id: uuid.UUID) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: uuid.UUID, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def publish(self, user_id: uuid.UUID, event: dict):
+        self.stats["published"] += 1
+        for queue in self.subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait(event)
+                self.stats["delivered"] += 1
+            except asyncio.QueueFull:
+                self.stats["dropped"] += 1
+
+    async def stream(self, user_id: uuid.UUID, keepalive: int = 15):
+        queue = self.subscribe(user_id)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+        finally:
+            self.unsubscribe(user_id, queue)
+
+    def metrics(self) -> dict:
+        return {**self.stats, "users": len(self.subscribers), "streams": sum(len(queues) for queues in self.subscribers.values())}
+
+user_events = UserEvents()
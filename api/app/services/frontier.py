@@ -0,0 +1,159 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List
+from urllib.parse import urlsplit
+
+from core.config import FRONTIER_DIR, CRAWL_PER_HOST_CONCURRENCY, CRAWL_PER_HOST_DELAY_MS
+from helpers.urls import normalize_url
+
+SKIPPED_EXTENSIONS = (
+    ".pdf", ".zip", ".gz", ".tar", ".rar", ".7z", ".exe", ".dmg", ".iso",
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico", ".bmp",
+    ".mp3", ".mp4", ".avi", ".mov", ".webm", ".css", ".js", ".json", ".xml",
+)
+
+def site_host(url: str) -> str:
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+class CrawlFrontier:
+    """On-disk queue of the urls of one website crawl.
+
+    Every url is stored normalized, so it is only ever queued once. Urls that
+    were handed out but never completed are queued again when the frontier is
+    reopened, which lets an interrupted crawl continue where it stopped.
+    """
+
+    def __init__(self, crawl_id: str, root_url: str, max_depth: int, max_pages: int):
+        Path(FRONTIER_DIR).mkdir(parents=True, exist_ok=True)
+        self.path = Path(FRONTIER_DIR) / f"{crawl_id}.sqlite"
+        self.root_url = normalize_url(root_url)
+        self.host = site_host(self.root_url)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                depth INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                added_at REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS urls_status_depth ON urls (status, depth)")
+        self._db.execute("UPDATE urls SET status = 'queued' WHERE status = 'in_progress'")
+        self._db.commit()
+
+        self.add([self.root_url], depth=0)
+
+    @staticmethod
+    def exists(crawl_id: str) -> bool:
+        return (Path(FRONTIER_DIR) / f"{crawl_id}.sqlite").exists()
+
+    @staticmethod
+    def discard(crawl_id: str):
+        path = Path(FRONTIER_DIR) / f"{crawl_id}.sqlite"
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+    def allowed(self, url: str) -> bool:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            return False
+        if site_host(url) != self.host:
+            return False
+        return not parts.path.lower().endswith(SKIPPED_EXTENSIONS)
+
+    def add(self, urls: Iterable[str], depth: int) -> int:
+        if depth > self.max_depth:
+            return 0
+
+        rows = [(normalize_url(url), depth, time.time()) for url in urls if self.allowed(url)]
+        with self._lock:
+            total = self._db.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+            budget = self.max_pages - total
+            if budget <= 0 or not rows:
+                return 0
+
+            before = self._db.total_changes
+            for row in rows:
+                if self._db.total_changes - before >= budget:
+                    break
+                self._db.execute("INSERT OR IGNORE INTO urls (url, depth, added_at) VALUES (?, ?, ?)", row)
+            self._db.commit()
+            return self._db.total_changes - before
+
+    def claim(self, limit: int = 1) -> List[tuple]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url, depth FROM urls WHERE status = 'queued' ORDER BY depth, added_at LIMIT ?",
+                (limit,),
+            ).fetchall()
+            self._db.executemany("UPDATE urls SET status = 'in_progress' WHERE url = ?", [(url,) for url, _ in rows])
+            self._db.commit()
+            return rows
+
+    def complete(self, url: str, success: bool = True):
+        with self._lock:
+            self._db.execute("UPDATE urls SET status = ? WHERE url = ?", ("done" if success else "failed", url))
+            self._db.commit()
+
+    def retry_failed(self) -> int:
+        """Queue the urls that failed again, so a crawl that is resumed retries them."""
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute("UPDATE urls SET status = 'queued' WHERE status = 'failed'")
+            self._db.commit()
+            return self._db.total_changes - before
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM urls GROUP BY status").fetchall()
+        counts = {"queued": 0, "in_progress": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def remove(self):
+        self.close()
+        self.discard(self.path.stem)
+
+class HostLimiter:
+    """Per-host politeness: caps concurrent requests and spaces out their start times."""
+
+    def __init__(self, concurrency: int = CRAWL_PER_HOST_CONCURRENCY, delay_ms: int = CRAWL_PER_HOST_DELAY_MS):
+        self.concurrency = concurrency
+        self.delay = delay_ms / 1000
+        self._hosts: dict[str, dict] = {}
+
+    def _host(self, url: str) -> dict:
+        host = urlsplit(url).hostname or ""
+        if host not in self._hosts:
+            self._hosts[host] = {"semaphore": asyncio.Semaphore(self.concurrency), "lock": asyncio.Lock(), "next_at": 0.0}
+        return self._hosts[host]
+
+    async def wait(self, url: str):
+        state = self._host(url)
+        await state["semaphore"].acquire()
+        try:
+            async with state["lock"]:
+                delay = state["next_at"] - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                state["next_at"] = time.monotonic() + self.delay
+        except BaseException:
+            state["semaphore"].release()
+            raise
+
+    def release(self, url: str):
+        self._host(url)["semaphore"].release()
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from sqlmodel import Session, select
+
+from core.config import UPLOAD_DIR, PROCESSED_DIR, CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES
+from core.db import engine
+from core.db.models import TrainingDocs, TrainingWebsite, TrainingStatus, JobKind
+from helpers.hashing import sha256_text
+from services.rag.retriever import ChromaDBManager
+from services.crawler import stream_site
+from services.frontier import CrawlFrontier
+from services.markdown_converter import convert_file_in_pool, iter_text_file
+from services.jobs import JobContext, job_queue, run_blocking, run_to_completion
+
+active_crawls: set[str] = set()
+
+def processed_path(documentId: str) -> str:
+    return f"{PROCESSED_DIR}/{documentId}.md"
+
+def read_processed(documentId: str) -> Optional[Iterator[str]]:
+    path = processed_path(documentId)
+    return iter_text_file(path) if os.path.exists(path) else None
+
+cromadb = ChromaDBManager(source=read_processed)
+
+def write_processed_file(documentId: str, content: str):
+    with open(processed_path(documentId), "w") as file:
+        file.write(content)
+
+def set_status(session: Session, row, status: TrainingStatus):
+    row.status = status
+    session.add(row)
+    session.commit()
+    session.refresh(row)
+
+async def convert_document(doc: TrainingDocs) -> int:
+    """Convert an upload into its processed markdown file; returns its character count."""
+    upload_file_path = UPLOAD_DIR + f"/{doc.file_name}"
+    if not os.path.exists(upload_file_path):
+        raise FileNotFoundError(f"{doc.file_name} not found")
+
+    return await convert_file_in_pool(upload_file_path, processed_path(str(doc.id)))
+
+def store_documents(session: Session, docs: List[TrainingDocs], character_counts: Dict[str, int]):
+    """Chunk and embed the processed files of docs in one streaming pass."""
+    cromadb.upsert_stream((str(doc.id), iter_text_file(processed_path(str(doc.id)))) for doc in docs)
+
+    for doc in docs:
+        doc.character_count = character_counts[str(doc.id)]
+        doc.status = TrainingStatus.completed
+        session.add(doc)
+    session.commit()
+
+def find_trained_copy(session: Session, doc: TrainingDocs) -> Optional[TrainingDocs]:
+    if not doc.content_hash:
+        return None
+
+    statement = select(TrainingDocs).where(
+        TrainingDocs.content_hash == doc.content_hash,
+        TrainingDocs.status == TrainingStatus.completed,
+        TrainingDocs.id != doc.id,
+    )
+    return session.exec(statement).first()
+
+def reuse_document(session: Session, doc: TrainingDocs) -> bool:
+    """Train doc from an already trained upload with the same content, if there is one.
+
+    The processed markdown is copied and the stored chunks are copied along with
+    their embeddings, so nothing is converted or embedded again.
+    """
+    source = find_trained_copy(session, doc)
+    if not source or not os.path.exists(processed_path(str(source.id))):
+        return False
+
+    shutil.copyfile(processed_path(str(source.id)), processed_path(str(doc.id)))
+    cromadb.copy_document(str(source.id), str(doc.id))
+
+    doc.character_count = source.character_count
+    set_status(session, doc, TrainingStatus.completed)
+    return True
+
+def store_website_page(session: Session, website: TrainingWebsite, page: dict, status: TrainingStatus = TrainingStatus.completed) -> TrainingWebsite:
+    # vectors first: a page is only marked trained once they are stored
+    content = page["content"]
+    write_processed_file(str(website.id), content)
+    cromadb.upsert(documents=[content], documentId=str(website.id))
+
+    website.status = status
+    website.character_count = len(content)
+    website.content_hash = sha256_text(content)
+    website.etag = page.get("etag")
+    website.last_modified = page.get("last_modified")
+    website.checked_at = datetime.now(timezone.utc)
+
+    session.add(website)
+    session.commit()
+    session.refresh(website)
+    return website
+
+def website_page(session: Session, main_website: TrainingWebsite, url: str) -> TrainingWebsite:
+    """The row of a crawled page, reused when a resumed crawl stores the page again."""
+    statement = select(TrainingWebsite).where(TrainingWebsite.parent_id == main_website.id, TrainingWebsite.url == url)
+    return session.exec(statement).first() or TrainingWebsite(url=url, parent_id=main_website.id)
+
+def can_resume_website(website: TrainingWebsite) -> bool:
+    # a failed crawl continues from its frontier, or starts over if it has none
+    return (
+        website.parent_id is None
+        and website.status == TrainingStatus.failed
+        and str(website.id) not in active_crawls
+    )
+
+async def ingest_website(
+    session: Session,
+    main_website: TrainingWebsite,
+    max_depth: int = CRAWL_MAX_DEPTH,
+    max_pages: int = CRAWL_MAX_PAGES,
+    job: Optional[JobContext] = None,
+) -> TrainingWebsite:
+    """Crawl a website and embed every page as it arrives.
+
+    Urls are taken from a CrawlFrontier kept on disk, so running this again for
+    the row of an interrupted or failed crawl continues it instead of starting
+    over, retrying the urls that failed. Pages stored again reuse their rows.
+    Pages stream into chunking and embedding while the next ones are being
+    fetched, and each stored page gets its own TrainingWebsite row; the root row
+    stays processing until the frontier is exhausted.
+    """
+    await run_blocking(set_status, session, main_website, TrainingStatus.processing)
+
+    crawl_id = str(main_website.id)
+    active_crawls.add(crawl_id)
+    frontier = await run_blocking(CrawlFrontier, crawl_id, main_website.url, max_depth, max_pages)
+    await run_blocking(frontier.retry_failed)
+
+    try:
+        async for page in stream_site(frontier):
+            if page["link"] == frontier.root_url:
+                await run_to_completion(store_website_page, session, main_website, page, TrainingStatus.processing)
+            else:
+                website = await run_blocking(website_page, session, main_website, page["link"])
+                await run_to_completion(store_website_page, session, website, page)
+            await run_blocking(frontier.complete, page["link"])
+
+            if job:
+                counts = await run_blocking(frontier.counts)
+                await job.progress(counts["done"] + counts["failed"], sum(counts.values()))
+
+        counts = await run_blocking(frontier.counts)
+    except Exception:
+        await run_blocking(set_status, session, main_website, TrainingStatus.failed)
+        raise
+    finally:
+        active_crawls.discard(crawl_id)
+        frontier.close()
+
+    status = TrainingStatus.completed if counts["done"] else TrainingStatus.failed
+    await run_blocking(set_status, session, main_website, status)
+
+    # a failed crawl keeps its frontier so it can be resumed
+    if status == TrainingStatus.completed:
+        await run_blocking(frontier.remove)
+    return main_website
+
+@job_queue.handler(JobKind.document)
+async def document_job(job: JobContext):
+    with Session(engine) as session:
+        doc = session.get(TrainingDocs, job.target_id)
+        if not doc:
+            raise LookupError("document was removed")
+
+        await run_blocking(set_status, session, doc, TrainingStatus.processing)
+        try:
+            if await run_blocking(reuse_document, session, doc):
+                await job.progress(1, 1)
+                return
+
+            character_count = await convert_document(doc)
+            await run_blocking(store_documents, session, [doc], {str(doc.id): character_count})
+        except Exception:
+            await run_blocking(set_status, session, doc, TrainingStatus.failed)
+            raise
+        await job.progress(1, 1)
+
+@job_queue.handler(JobKind.document_batch)
+async def document_batch_job(job: JobContext):
+    """Convert many uploads in parallel worker processes, then chunk and embed them in one streaming pass."""
+    with Session(engine, expire_on_commit=False) as session:
+        docs = [doc for doc_id in job.payload["doc_ids"] if (doc := session.get(TrainingDocs, uuid.UUID(doc_id)))]
+        if not docs:
+            raise LookupError("documents were removed")
+
+        for doc in docs:
+            doc.status = TrainingStatus.processing
+            session.add(doc)
+        await run_blocking(session.commit)
+
+        total = len(docs)
+        docs = [doc for doc in docs if not await run_blocking(reuse_document, session, doc)]
+
+        character_counts: Dict[str, int] = {}
+        converted = total - len(docs)
+
+        async def convert(doc: TrainingDocs):
+            nonlocal converted
+            try:
+                character_counts[str(doc.id)] = await convert_document(doc)
+            except Exception as e:
+                print(f"Error converting {doc.file_name}: {e}")
+            converted += 1
+            await job.progress(converted, total)
+
+        await asyncio.gather(*[convert(doc) for doc in docs])
+
+        converted_docs = [doc for doc in docs if str(doc.id) in character_counts]
+        failed = [doc for doc in docs if str(doc.id) not in character_counts]
+        for doc in failed:
+            doc.status = TrainingStatus.failed
+            session.add(doc)
+        await run_blocking(session.commit)
+
+        if converted_docs:
+            try:
+                await run_blocking(store_documents, session, converted_docs, character_counts)
+            except Exception:
+                for doc in converted_docs:
+                    doc.status = TrainingStatus.failed
+                    session.add(doc)
+                await run_blocking(session.commit)
+                raise
+
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {total} documents could not be converted")
+
+@job_queue.handler(JobKind.website)
+async def website_job(job: JobContext):
+    with Session(engine) as session:
+        website = session.get(TrainingWebsite, job.target_id)
+        if not website:
+            raise LookupError("website was removed")
+
+        await ingest_website(
+            session,
+            website,
+            max_depth=job.payload.get("max_depth") or CRAWL_MAX_DEPTH,
+            max_pages=job.payload.get("max_pages") or CRAWL_MAX_PAGES,
+            job=job,
+        )
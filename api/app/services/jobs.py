@@ -0,0 +1,219 @@
+import asyncio
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlmodel import Session, select, update
+
+from core.config import INGESTION_CONCURRENCY, INGESTION_POLL_INTERVAL, INGESTION_MAX_ATTEMPTS
+from core.db import engine
+from core.db.models import IngestionJobs, JobKind, TrainingStatus, TrainingDocs, TrainingWebsite
+
+ingestion_executor = ThreadPoolExecutor(max_workers=INGESTION_CONCURRENCY, thread_name_prefix="ingestion")
+
+async def run_blocking(fn: Callable, *args):
+    """Run blocking ingestion work on its own threads so it never queues behind chat requests."""
+    return await asyncio.get_running_loop().run_in_executor(ingestion_executor, fn, *args)
+
+async def run_to_completion(fn: Callable, *args):
+    """run_blocking for writes: a cancelled caller still waits for fn to return,
+    so a cancelled job never leaves a write running behind it."""
+    future = asyncio.ensure_future(run_blocking(fn, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait({future})
+        raise
+
+Handler = Callable[["JobContext"], Awaitable[None]]
+
+def job_targets(job: IngestionJobs) -> List[tuple]:
+    """(model, id) pairs of the rows whose status a job drives."""
+    if job.kind == JobKind.document and job.target_id:
+        return [(TrainingDocs, job.target_id)]
+    if job.kind == JobKind.website and job.target_id:
+        return [(TrainingWebsite, job.target_id)]
+    if job.kind == JobKind.document_batch:
+        return [(TrainingDocs, uuid.UUID(str(doc_id))) for doc_id in json.loads(job.payload).get("doc_ids", [])]
+    return []
+
+def fail_targets(session: Session, job: IngestionJobs):
+    """Mark the rows of a failed job failed too, unless they already finished.
+
+    Otherwise they would show as in progress forever, and a failed website
+    is the only kind that can be resumed.
+    """
+    for model, target_id in job_targets(job):
+        session.exec(
+            update(model)
+            .where(model.id == target_id, model.status.in_([TrainingStatus.pending, TrainingStatus.processing]))
+            .values(status=TrainingStatus.failed)
+        )
+
+class JobContext:
+    def __init__(self, job: IngestionJobs):
+        self.id = job.id
+        self.target_id = job.target_id
+        self.payload = json.loads(job.payload)
+
+    def _progress(self, done: int, total: int):
+        with Session(engine) as session:
+            session.exec(update(IngestionJobs).where(IngestionJobs.id == self.id).values(progress=done, total=total))
+            session.commit()
+
+    async def progress(self, done: int, total: int):
+        await run_blocking(self._progress, done, total)
+
+class JobQueue:
+    """Ingestion jobs stored in the database and run by a bounded pool of workers.
+
+    Jobs left processing by a previous process are put back to pending on
+    start, so they survive restarts (up to INGESTION_MAX_ATTEMPTS tries).
+    """
+
+    def __init__(self, concurrency: int = INGESTION_CONCURRENCY, poll_interval: int = INGESTION_POLL_INTERVAL, max_attempts: int = INGESTION_MAX_ATTEMPTS):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.handlers: Dict[JobKind, Handler] = {}
+
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[uuid.UUID, tuple] = {}
+        self._cancelled: set = set()
+
+    def handler(self, kind: JobKind):
+        def register(fn: Handler):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def enqueue(self, session: Session, kind: JobKind, target_id: Optional[uuid.UUID] = None, payload: Optional[dict] = None) -> IngestionJobs:
+        job = IngestionJobs(kind=kind, target_id=target_id, payload=json.dumps(payload or {}, default=str))
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+
+        self._wakeup.set()
+        return job
+
+    def _requeue_interrupted(self):
+        with Session(engine) as session:
+            exhausted = session.exec(
+                select(IngestionJobs)
+                .where(IngestionJobs.status == TrainingStatus.processing, IngestionJobs.attempts >= self.max_attempts)
+            ).fetchall()
+            for job in exhausted:
+                job.status = TrainingStatus.failed
+                job.error = "interrupted too many times"
+                session.add(job)
+                fail_targets(session, job)
+            session.exec(
+                update(IngestionJobs)
+                .where(IngestionJobs.status == TrainingStatus.processing)
+                .values(status=TrainingStatus.pending)
+            )
+            session.commit()
+
+    def _claim(self) -> Optional[IngestionJobs]:
+        with Session(engine) as session:
+            candidates = session.exec(
+                select(IngestionJobs.id)
+                .where(IngestionJobs.status == TrainingStatus.pending)
+                .order_by(IngestionJobs.created_at)
+                .limit(self.concurrency)
+            ).fetchall()
+
+            for job_id in candidates:
+                claimed = session.exec(
+                    update(IngestionJobs)
+                    .where(IngestionJobs.id == job_id, IngestionJobs.status == TrainingStatus.pending)
+                    .values(status=TrainingStatus.processing, attempts=IngestionJobs.attempts + 1)
+                )
+                session.commit()
+                if claimed.rowcount:
+                    return session.get(IngestionJobs, job_id)
+        return None
+
+    def _finish(self, job_id: uuid.UUID, error: Optional[str] = None):
+        with Session(engine) as session:
+            job = session.get(IngestionJobs, job_id)
+            job.status = TrainingStatus.failed if error else TrainingStatus.completed
+            job.error = error
+            session.add(job)
+            if error:
+                fail_targets(session, job)
+            session.commit()
+
+    def _cancel_pending(self, target_id: uuid.UUID):
+        with Session(engine) as session:
+            session.exec(
+                update(IngestionJobs)
+                .where(IngestionJobs.target_id == target_id, IngestionJobs.status == TrainingStatus.pending)
+                .values(status=TrainingStatus.failed, error="cancelled")
+            )
+            session.commit()
+
+    async def cancel(self, target_id: uuid.UUID):
+        """Stop every job of a target that is being removed.
+
+        Pending jobs are failed; running ones are cancelled and waited for, so
+        nothing is written for the target once this returns.
+        """
+        await run_blocking(self._cancel_pending, target_id)
+
+        tasks = []
+        for job_id, (job_target_id, task) in list(self._running.items()):
+            if job_target_id == target_id:
+                self._cancelled.add(job_id)
+                task.cancel()
+                tasks.append(task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: IngestionJobs):
+        handler = self.handlers.get(job.kind)
+        task = None
+        try:
+            if not handler:
+                raise RuntimeError(f"no handler for {job.kind} jobs")
+            task = asyncio.ensure_future(handler(JobContext(job)))
+            self._running[job.id] = (job.target_id, task)
+            await task
+        except asyncio.CancelledError:
+            if job.id not in self._cancelled:
+                raise
+            await run_blocking(self._finish, job.id, "cancelled")
+        except Exception as e:
+            print(f"Ingestion job {job.id} failed: {e}")
+            await run_blocking(self._finish, job.id, str(e) or type(e).__name__)
+        else:
+            await run_blocking(self._finish, job.id)
+        finally:
+            self._running.pop(job.id, None)
+            self._cancelled.discard(job.id)
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            job = await run_blocking(self._claim)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def start(self):
+        await run_blocking(self._requeue_interrupted)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+job_queue = JobQueue()
@@ -1,7 +1,81 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, Optional
+
 from markitdown import MarkItDown
 
+from core.config import CONVERSION_WORKERS, CHUNK_WINDOW_CHARS
+
+PLAIN_TEXT_SUFFIXES = {".txt", ".md", ".markdown", ".rst", ".csv", ".log"}
+
+_markitdown: Optional[MarkItDown] = None
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_markitdown() -> MarkItDown:
+    global _markitdown
+    if _markitdown is None:
+        _markitdown = MarkItDown(enable_plugins=False)
+    return _markitdown
+
 def convert_to_markdown(file: str):
-    md = MarkItDown(enable_plugins=False)
-    result = md.convert(file)
+    result = _get_markitdown().convert(file)
 
     return result.text_content
+
+def _pdf_pages(file: str) -> Iterator[str]:
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+
+    for page in extract_pages(file):
+        yield "".join(element.get_text() for element in page if isinstance(element, LTTextContainer))
+
+def iter_text_file(file: str, block_size: int = CHUNK_WINDOW_CHARS) -> Iterator[str]:
+    with open(file, "r", errors="replace") as source:
+        while block := source.read(block_size):
+            yield block
+
+def convert_to_file(file: str, destination: str) -> int:
+    """Convert file to markdown written straight to destination; returns the character count.
+
+    PDFs are converted one page at a time and plain text is copied as is, so
+    neither is ever held in memory as a whole.
+    """
+    suffix = Path(file).suffix.lower()
+
+    characters = 0
+    with open(destination, "w") as output:
+        if suffix in PLAIN_TEXT_SUFFIXES:
+            for block in iter_text_file(file):
+                output.write(block)
+                characters += len(block)
+        elif suffix == ".pdf":
+            for page in _pdf_pages(file):
+                output.write(page + "\n\n")
+                characters += len(page) + 2
+        else:
+            content = convert_to_markdown(file)
+            output.write(content)
+            characters = len(content)
+    return characters
+
+def start_conversion_pool():
+    """Start worker processes that each keep one warm MarkItDown instance."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=CONVERSION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_get_markitdown,
+        )
+
+def stop_conversion_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+async def convert_file_in_pool(file: str, destination: str) -> int:
+    start_conversion_pool()
+    return await asyncio.get_running_loop().run_in_executor(_pool, convert_to_file, file, destination)
@@ -0,0 +1,71 @@
+import asyncio
+from typing import Dict, List, Tuple
+
+from core.config import RETRIEVAL_MAX_BATCH, RETRIEVAL_MAX_WAIT_MS
+from .retriever import ChromaDBManager
+
+class QueryBatcher:
+    """Collects retrieval queries that arrive together and runs them as one query.
+
+    A batch is sent once it holds max_batch_size queries or its first query has
+    waited max_wait_ms, whichever comes first; every caller then gets back the
+    hits (id, document, metadata) for its own query.
+    """
+
+    def __init__(self, manager: ChromaDBManager, max_batch_size: int = RETRIEVAL_MAX_BATCH, max_wait_ms: int = RETRIEVAL_MAX_WAIT_MS):
+        self.manager = manager
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = {"queries": 0, "batches": 0, "largest_batch": 0}
+
+        self._pending: Dict[int, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def query(self, text: str, n_results: int = 3) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self._pending.setdefault(n_results, [])
+        batch.append((text, future))
+        self.stats["queries"] += 1
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(n_results)
+        elif len(batch) == 1:
+            self._timers[n_results] = loop.call_later(self.max_wait, self._flush, n_results)
+
+        return await future
+
+    def _flush(self, n_results: int):
+        timer = self._timers.pop(n_results, None)
+        if timer:
+            timer.cancel()
+
+        batch = self._pending.pop(n_results, [])
+        if batch:
+            task = asyncio.create_task(self._run(batch, n_results))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]], n_results: int):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.stats["batches"] += 1
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+
+        try:
+            results = await asyncio.to_thread(self.manager.search, texts, n_results)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, results))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def metrics(self) -> dict:
+        batches = self.stats["batches"]
+        return {**self.stats, "average_batch": round(self.stats["queries"] / batches, 2) if batches else 0.0}
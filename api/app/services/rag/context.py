@@ -0,0 +1,83 @@
+from typing import Dict, List
+
+from core.config import CONTEXT_TOKEN_BUDGET
+
+CHARS_PER_TOKEN = 4
+MAX_OVERLAP_WORDS = 80
+SHINGLE_WORDS = 8
+DUPLICATE_SHARE = 0.8
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def join_overlapping(left: List[str], right: List[str]) -> List[str]:
+    """Append right to left without repeating the words where left's tail is right's head."""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_WORDS), 0, -1):
+        if left[-size:] == right[:size]:
+            return left + right[size:]
+    return left + right
+
+def shingles(words: List[str]) -> set:
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def merge_passages(hits: List[Dict]) -> List[List[str]]:
+    """Merge hits of the same document whose chunk_index values are equal or consecutive.
+
+    Passages come back as word lists, ordered by the rank of their best hit.
+    """
+    groups: Dict[str, List[tuple]] = {}
+    for rank, hit in enumerate(hits):
+        metadata = hit.get("metadata") or {}
+        documentId = metadata.get("document_id", hit["id"])
+        groups.setdefault(documentId, []).append((metadata.get("chunk_index", rank), rank, hit["document"]))
+
+    passages = []
+    for chunks in groups.values():
+        chunks.sort()
+        current_index, best_rank, words = chunks[0][0], chunks[0][1], chunks[0][2].split()
+        for index, rank, text in chunks[1:]:
+            if index == current_index:
+                continue
+            if index == current_index + 1:
+                words = join_overlapping(words, text.split())
+                best_rank = min(best_rank, rank)
+            else:
+                passages.append((best_rank, words))
+                best_rank, words = rank, text.split()
+            current_index = index
+        passages.append((best_rank, words))
+
+    passages.sort(key=lambda passage: passage[0])
+    return [words for _, words in passages]
+
+def assemble_context(hits: List[Dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Build the retrieval passage for a prompt from ranked hits.
+
+    Adjacent chunks of a document are stitched back together without their
+    overlap, passages that mostly repeat text already included are skipped,
+    and passages are added best first until token_budget is reached, the
+    last one cut at a word boundary.
+    """
+    included, covered, used = [], set(), 0
+
+    for words in merge_passages(hits):
+        passage_shingles = shingles(words)
+        if passage_shingles and len(passage_shingles & covered) / len(passage_shingles) >= DUPLICATE_SHARE:
+            continue
+
+        text = " ".join(words)
+        remaining = token_budget - used
+        if estimate_tokens(text) > remaining:
+            text = text[:remaining * CHARS_PER_TOKEN].rsplit(" ", 1)[0]
+            if not text:
+                break
+
+        included.append(text)
+        covered |= passage_shingles
+        used += estimate_tokens(text)
+        if used >= token_budget:
+            break
+
+    return "\n\n".join(included)
@@ -0,0 +1,181 @@
+import sqlite3
+import threading
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from core.config import DEDUP_THRESHOLD, MINHASH_PERMUTATIONS, LSH_BANDS
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+class NearDuplicateIndex:
+    """MinHash signatures of stored chunks, bucketed with LSH.
+
+    A chunk is a near duplicate of another when the estimated Jaccard
+    similarity of their word 3-gram sets reaches threshold. LSH splits each
+    signature into bands so only chunks sharing at least one band are
+    compared.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD / 100, permutations: int = MINHASH_PERMUTATIONS, bands: int = LSH_BANDS, shingle_size: int = 3):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        self.shingle_size = shingle_size
+        self.ready = False
+
+        rng = np.random.default_rng(1)
+        self.a = rng.integers(1, 1 << 31, permutations, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, permutations, dtype=np.uint64)
+
+        self.buckets: Dict[tuple, set] = defaultdict(set)
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.document_ids: Dict[str, str] = {}
+        self.by_document: Dict[str, set] = defaultdict(set)
+        self.lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def signature(self, text: str) -> np.ndarray:
+        words = text.split()
+        shingles = {" ".join(words[i:i + self.shingle_size]) for i in range(max(len(words) - self.shingle_size + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        return ((hashes[:, None] * self.a + self.b) % MERSENNE_PRIME).min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def _find(self, signature: np.ndarray, documentId: str) -> Optional[str]:
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates |= self.buckets.get(key, set())
+
+        for id in candidates:
+            if self.document_ids[id] != documentId and np.mean(self.signatures[id] == signature) >= self.threshold:
+                return id
+        return None
+
+    def _insert(self, id: str, documentId: str, signature: np.ndarray):
+        self.signatures[id] = signature
+        self.document_ids[id] = documentId
+        self.by_document[documentId].add(id)
+        for key in self._band_keys(signature):
+            self.buckets[key].add(id)
+
+    def claim(self, id: str, documentId: str, text: str) -> Optional[str]:
+        """Register a new chunk, or return the id of a chunk of another document it duplicates."""
+        signature = self.signature(text)
+        with self.lock:
+            duplicate = self._find(signature, documentId)
+            if duplicate is None:
+                self._insert(id, documentId, signature)
+            return duplicate
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        for id, text, metadata in zip(ids, documents, metadatas):
+            if id not in self.signatures:
+                signature = self.signature(text)
+                with self.lock:
+                    self._insert(id, metadata.get("document_id"), signature)
+
+    def document_of(self, id: str) -> Optional[str]:
+        with self.lock:
+            return self.document_ids.get(id)
+
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict]):
+        pass
+
+    def remove(self, ids: List[str]):
+        with self.lock:
+            for id in ids:
+                signature = self.signatures.pop(id, None)
+                if signature is None:
+                    continue
+
+                for key in self._band_keys(signature):
+                    bucket = self.buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(id)
+                        if not bucket:
+                            del self.buckets[key]
+
+                documentId = self.document_ids.pop(id)
+                self.by_document[documentId].discard(id)
+                if not self.by_document[documentId]:
+                    del self.by_document[documentId]
+
+    def remove_document(self, documentId: str):
+        with self.lock:
+            self.remove(list(self.by_document.get(documentId, ())))
+
+    def stats(self) -> dict:
+        return {"ready": self.ready, "chunks": len(self.signatures), "threshold": self.threshold}
+
+class DuplicateOwners:
+    """Which documents dropped a chunk as a near duplicate of which stored chunk.
+
+    Dropped chunks are stored nowhere, so this is kept on disk next to the
+    vectors: once the chunk a document deferred to is deleted, that document
+    has to be ingested again to get the text back.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS duplicates (
+                chunk_id TEXT NOT NULL,
+                owner_document TEXT NOT NULL,
+                document TEXT NOT NULL,
+                PRIMARY KEY (chunk_id, document)
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS duplicates_owner ON duplicates (owner_document)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS duplicates_document ON duplicates (document)")
+        self._db.commit()
+
+    def add(self, chunk_id: str, owner_document: str, document: str):
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO duplicates VALUES (?, ?, ?)", (chunk_id, owner_document, document))
+            self._db.commit()
+
+    def forget(self, document: str):
+        """Drop what document deferred to, before it is ingested again or deleted."""
+        with self._lock:
+            self._db.execute("DELETE FROM duplicates WHERE document = ?", (document,))
+            self._db.commit()
+
+    def copy(self, source: str, target: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO duplicates SELECT chunk_id, owner_document, ? FROM duplicates WHERE document = ?",
+                (target, source),
+            )
+            self._db.commit()
+
+    def _take(self, where: str, args: list) -> Set[str]:
+        with self._lock:
+            documents = {row[0] for row in self._db.execute(f"SELECT document FROM duplicates WHERE {where}", args)}
+            self._db.execute(f"DELETE FROM duplicates WHERE {where}", args)
+            self._db.commit()
+            return documents
+
+    def take_chunks(self, chunk_ids: Iterable[str]) -> Set[str]:
+        """Documents that deferred to any of chunk_ids, which are going away."""
+        documents = set()
+        chunk_ids = list(chunk_ids)
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            documents |= self._take(f"chunk_id IN ({','.join('?' * len(batch))})", batch)
+        return documents
+
+    def take_document(self, owner_document: str) -> Set[str]:
+        """Documents that deferred to a chunk of owner_document, which is going away."""
+        return self._take("owner_document = ?", [owner_document])
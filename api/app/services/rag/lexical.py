@@ -0,0 +1,171 @@
+import heapq
+import math
+import sys
+import threading
+from collections import Counter, defaultdict
+from itertools import islice
+from typing import Dict, Iterable, List, Tuple
+
+from core.config import LEXICAL_RARE_DF, LEXICAL_MAX_DF_PERCENT, LEXICAL_MAX_POSTINGS
+
+RRF_K = 60
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just me more most my no nor not now of off on once only or other our
+ours out over own same she should so some such than that the their theirs them then there these they this those
+through to too under until up very was we were what when where which while who whom why will with would you your
+""".split())
+
+class BM25Index:
+    """In-memory inverted index over chunk texts, scored with BM25.
+
+    Chunk texts are already cleaned to lowercase alphanumerics, so a chunk's
+    terms are just its whitespace-separated words; queries must be cleaned the
+    same way before they are split.
+
+    Only what scoring needs is kept per chunk: its term counts (in the
+    postings), its length and its distinct terms, interned so they share the
+    postings' keys. The text itself stays in the vector store, where search
+    results are read from.
+    """
+
+    def __init__(
+        self,
+        k1: float = 1.5,
+        b: float = 0.75,
+        rare_df: int = LEXICAL_RARE_DF,
+        max_df_percent: int = LEXICAL_MAX_DF_PERCENT,
+        max_postings: int = LEXICAL_MAX_POSTINGS,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.rare_df = rare_df
+        self.max_df_percent = max_df_percent
+        self.max_postings = max_postings
+        self.ready = False
+
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.lengths: Dict[str, int] = {}
+        self.terms: Dict[str, Tuple[str, ...]] = {}
+        self.document_ids: Dict[str, str] = {}
+        self.by_document: Dict[str, set] = defaultdict(set)
+        self.total_length = 0
+        self.lock = threading.RLock()
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        with self.lock:
+            self.remove([id for id in ids if id in self.lengths])
+            for id, text, metadata in zip(ids, documents, metadatas):
+                terms = Counter(map(sys.intern, text.split()))
+                for term, count in terms.items():
+                    self.postings[term][id] = count
+
+                length = sum(terms.values())
+                self.lengths[id] = length
+                self.total_length += length
+                self.terms[id] = tuple(terms)
+                self.document_ids[id] = metadata.get("document_id")
+                self.by_document[self.document_ids[id]].add(id)
+
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict]):
+        with self.lock:
+            for id, metadata in zip(ids, metadatas):
+                documentId = metadata.get("document_id")
+                if id in self.document_ids and self.document_ids[id] != documentId:
+                    self._forget_document(id)
+                    self.document_ids[id] = documentId
+                    self.by_document[documentId].add(id)
+
+    def _forget_document(self, id: str):
+        documentId = self.document_ids.pop(id)
+        self.by_document[documentId].discard(id)
+        if not self.by_document[documentId]:
+            del self.by_document[documentId]
+
+    def remove(self, ids: Iterable[str]):
+        with self.lock:
+            for id in ids:
+                terms = self.terms.pop(id, None)
+                if terms is None:
+                    continue
+
+                for term in terms:
+                    postings = self.postings.get(term)
+                    if postings is not None:
+                        postings.pop(id, None)
+                        if not postings:
+                            del self.postings[term]
+
+                self.total_length -= self.lengths.pop(id)
+                self._forget_document(id)
+
+    def remove_document(self, documentId: str):
+        with self.lock:
+            self.remove(list(self.by_document.get(documentId, ())))
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.lengths) - df + 0.5) / (df + 0.5))
+
+    def search(self, terms: List[str], n: int) -> List[Tuple[str, float]]:
+        """Best n chunks for terms by BM25, scored from a snapshot taken under the lock.
+
+        Stopwords and terms in more than max_df_percent of the chunks carry
+        next to no weight and are skipped. Terms are scored rarest first; a
+        term with more than max_postings chunks only adds to the scores of
+        chunks already found, so one common term never scans its whole list.
+        """
+        with self.lock:
+            count = len(self.lengths)
+            if not count:
+                return []
+
+            average = self.total_length / count
+            max_df = max(self.rare_df, count * self.max_df_percent / 100)
+            selected = []
+            for term in set(terms) - STOPWORDS:
+                postings = self.postings.get(term)
+                if not postings or len(postings) > max_df:
+                    continue
+                # a long list is only looked into outside the lock, which a
+                # concurrent write can't break; copying it would cost a scan
+                snapshot = list(postings.items()) if len(postings) <= self.max_postings else None
+                selected.append((len(postings), self.idf(term), snapshot, postings))
+
+        scores: Dict[str, float] = defaultdict(float)
+        for _, idf, snapshot, postings in sorted(selected, key=lambda item: item[0]):
+            if snapshot is None:
+                if scores:
+                    snapshot = [(id, tf) for id in list(scores) if (tf := postings.get(id))]
+                else:
+                    with self.lock:
+                        snapshot = list(islice(postings.items(), self.max_postings))
+
+            for id, tf in snapshot:
+                length = self.lengths.get(id)
+                if length is None:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / average)
+                scores[id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(n, scores.items(), key=lambda item: item[1])
+
+    def needles(self, terms: List[str]) -> List[str]:
+        """Query terms so rare in the corpus that they are almost certainly names or codes."""
+        with self.lock:
+            return [term for term in set(terms) if 0 < len(self.postings.get(term, ())) <= self.rare_df]
+
+    def contains(self, id: str, terms: List[str]) -> bool:
+        with self.lock:
+            return all(id in self.postings.get(term, ()) for term in terms)
+
+    def stats(self) -> dict:
+        return {"ready": self.ready, "chunks": len(self.lengths), "terms": len(self.postings)}
+
+def reciprocal_rank_fusion(rankings: List[List[str]], n: int, k: int = RRF_K) -> List[str]:
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] += 1 / (k + rank + 1)
+    return [id for id, _ in heapq.nlargest(n, scores.items(), key=lambda item: item[1])]
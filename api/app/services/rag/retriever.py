@@ -1,10 +1,21 @@
+import multiprocessing
 import re
-from typing import Optional, List, Dict
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional, List, Dict, Iterable, Iterator, Set, Tuple
 
-import chromadb
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
 from chonkie import SentenceChunker
 
-from core.config import VECTOR_DB_DIR
+from core.config import VECTOR_DB_DIR, EMBED_BATCH_SIZE, CHUNK_WINDOW_CHARS, CHUNK_WORKERS, CHUNK_PROCESSES, QUERY_CACHE_SIZE, LEXICAL_SEARCH
+from helpers.hashing import sha256_text
+from .dedup import NearDuplicateIndex, DuplicateOwners
+from .lexical import BM25Index, reciprocal_rank_fusion
+from .vector_store import create_store
 
 class Chunker:
     """Semantic chunker using SDPMChunker from Chonkie."""
@@ -18,42 +29,565 @@ class Chunker:
     def batch_chunks(self, texts: List[str]):
         return self.chunker.chunk_batch(texts)
 
+    def split(self, buffer: str, window: int, final: bool) -> Tuple[List[str], str]:
+        """Chunk texts that are complete in buffer, and the text to carry over to the next window."""
+        chunks = self.chunker.chunk(buffer)
+        if final or len(chunks) < 2 and len(buffer) >= 4 * window:
+            return [chunk.text for chunk in chunks], ""
+        if len(chunks) < 2:
+            return [], buffer
+        return [chunk.text for chunk in chunks[:-1]], buffer[chunks[-1].start_index:]
+
+    def iter_chunks(
+        self,
+        blocks: Iterable[str],
+        window: int = CHUNK_WINDOW_CHARS,
+        split: Optional[Callable[[str, int, bool], Tuple[List[str], str]]] = None,
+    ) -> Iterator[str]:
+        """Chunk text that arrives in pieces, keeping only about one window of it in memory.
+
+        The last chunk of every window may be cut short, so its text is carried
+        over and chunked again together with the next window.
+        """
+        split = split or self.split
+        buffer = ""
+        for block in blocks:
+            buffer += block
+            if len(buffer) < window:
+                continue
+
+            texts, buffer = split(buffer, window, False)
+            yield from texts
+
+        if buffer.strip():
+            texts, _ = split(buffer, window, True)
+            yield from texts
+
+NON_ALPHANUMERIC = re.compile(r'[^a-zA-Z0-9\s]')
+WHITESPACE = re.compile(r'\s+')
+
+class PipelineAborted(Exception):
+    pass
+
+def text_cleanup(text: str) -> str:
+    text = NON_ALPHANUMERIC.sub('', text)
+    text = WHITESPACE.sub(' ', text)
+    text = text.lower()
+    return text.strip()
+
+_process_chunker: Optional[Chunker] = None
+_chunk_pool: Optional[ProcessPoolExecutor] = None
+_chunk_pool_lock = threading.Lock()
+
+def _start_process_chunker():
+    global _process_chunker
+    _process_chunker = Chunker()
+
+def _split_and_clean(buffer: str, window: int, final: bool) -> Tuple[List[str], str]:
+    texts, rest = _process_chunker.split(buffer, window, final)
+    return [text_cleanup(text) for text in texts], rest
+
+def start_chunk_pool() -> Optional[ProcessPoolExecutor]:
+    """Start worker processes that each keep one warm Chunker, unless CHUNK_PROCESSES is 0."""
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is None and CHUNK_PROCESSES > 0:
+            _chunk_pool = ProcessPoolExecutor(
+                max_workers=CHUNK_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_start_process_chunker,
+            )
+        return _chunk_pool
+
+def stop_chunk_pool():
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is not None:
+            _chunk_pool.shutdown(cancel_futures=True)
+            _chunk_pool = None
+
+class LRUCache:
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+# Every ChromaDBManager on the same collection shares its corpus version, so a
+# write made through one instance invalidates results cached through another.
+corpus_versions: Dict[str, int] = defaultdict(int)
+query_embeddings = LRUCache()
+query_results = LRUCache()
+lexical_indexes: Dict[str, BM25Index] = {}
+near_duplicate_indexes: Dict[str, NearDuplicateIndex] = {}
+duplicate_owners: Dict[tuple, DuplicateOwners] = {}
+duplicate_owners_lock = threading.Lock()
+
+def normalize_query(text: str) -> str:
+    return WHITESPACE.sub(' ', text).strip().lower()
+
+def query_cache_stats() -> dict:
+    return {"embeddings": query_embeddings.stats(), "results": query_results.stats()}
+
 class ChromaDBManager:
-    def __init__(self, collection_name: str = 'chatbot_trainings', store_path: str = VECTOR_DB_DIR):
+    def __init__(
+        self,
+        collection_name: str = 'chatbot_trainings',
+        store_path: str = VECTOR_DB_DIR,
+        source: Optional[Callable[[str], Optional[Iterable[str]]]] = None,
+    ):
+        self.collection_name = collection_name
         self.chunker = Chunker()
-        self.client = chromadb.PersistentClient(path=store_path)
-        self.collection = self.client.get_or_create_collection(name=collection_name)
+        self.embedding_function = DefaultEmbeddingFunction()
+        self.store = create_store(collection_name, store_path, self.embedding_function)
+        self.lexical = lexical_indexes.setdefault(collection_name, BM25Index())
+        self.near_duplicates = near_duplicate_indexes.setdefault(collection_name, NearDuplicateIndex())
+        with duplicate_owners_lock:
+            key = (store_path, collection_name)
+            if key not in duplicate_owners:
+                duplicate_owners[key] = DuplicateOwners(Path(store_path) / "dedup" / f"{collection_name}.sqlite")
+            self.duplicate_owners = duplicate_owners[key]
+        # reads the text blocks of a document back, so documents whose near
+        # duplicates lost the chunk they deferred to can be ingested again
+        self.source = source
+        self.hybrid = bool(LEXICAL_SEARCH)
+        self.stats = {
+            "embedded": 0, "unchanged": 0, "moved": 0, "deleted": 0, "near_duplicates": 0, "embed_seconds": 0.0,
+            "lexical_queries": 0, "fused_queries": 0, "vector_queries": 0,
+        }
+        self._local = threading.local()
 
     def text_cleanup(self, text: str) -> str:
-        text = re.sub(r'[^a-zA-Z0-9\s]', '', text)
-        text = re.sub(r'\s+', ' ', text)
-        text = text.lower()
-        return text.strip()
+        return text_cleanup(text)
+
+    def metrics(self) -> dict:
+        seconds = self.stats["embed_seconds"]
+        return {
+            **self.stats,
+            "chunks_per_sec": round(self.stats["embedded"] / seconds, 1) if seconds else 0.0,
+            "store": self.store.stats(),
+            "lexical": self.lexical.stats(),
+            "near_duplicate_index": self.near_duplicates.stats(),
+        }
+
+    def worker_chunker(self) -> Chunker:
+        if not hasattr(self._local, "chunker"):
+            self._local.chunker = Chunker()
+        return self._local.chunker
+
+    def clean_chunks(self, blocks: Iterable[str]) -> Iterator[str]:
+        """Cleaned chunk texts of blocks, split in the chunk pool when there is one."""
+        pool = start_chunk_pool()
+        if pool is None:
+            return (text_cleanup(text) for text in self.worker_chunker().iter_chunks(blocks))
+        return self.worker_chunker().iter_chunks(
+            blocks, split=lambda buffer, window, final: pool.submit(_split_and_clean, buffer, window, final).result()
+        )
 
     def ingest(self, documents: List[str], id: str):
         return self.upsert(documents, id)
 
-    def query(self, query_texts: List[str], n_results: int = 3) -> Dict:
-        result = self.collection.query(query_texts=query_texts, n_results=n_results)
-        return result['documents']
-    
-    def upsert(self, documents: List[str], documentId: str):
-        batch_chunks = self.chunker.batch_chunks(documents)
-
-        texts = []
-        for doc_chunks in batch_chunks:
-            for chunk in doc_chunks:
-                texts.append(self.text_cleanup(chunk.text))
-
-        ids = [f"{documentId}_chunk_{i}" for i in range(len(texts))]
-        metadatas = [{"document_id": documentId, "chunk_index": i} for i in range(len(texts))]
-
-        self.collection.upsert(
-            documents=texts,
-            metadatas=metadatas,
-            ids=ids,
-        )
+    def bump_version(self):
+        corpus_versions[self.collection_name] += 1
+
+    def embed_queries(self, queries: List[str]) -> List:
+        embeddings = [query_embeddings.get(query) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(missing, self.embedding_function([queries[i] for i in missing])):
+                query_embeddings.put(queries[i], embedding)
+                embeddings[i] = embedding
+        return embeddings
+
+    def ensure_index(self, index):
+        """Build an in-memory index (lexical or near-duplicate) from the store the first time it is needed."""
+        with index.lock:
+            if index.ready:
+                return
+            for batch in self.store.iter_chunks(EMBED_BATCH_SIZE):
+                index.add(batch["ids"], batch["documents"], batch["metadatas"])
+            index.ready = True
+
+    def ensure_lexical(self):
+        self.ensure_index(self.lexical)
+
+    def update_indexes(self, method: str, *args):
+        # before its first build an index has nothing to keep in sync; the
+        # build reads the store, which already has this write
+        for index in (self.lexical, self.near_duplicates):
+            with index.lock:
+                if index.ready:
+                    getattr(index, method)(*args)
+
+    def search(self, query_texts: List[str], n_results: int = 3) -> List[List[Dict]]:
+        """Top n_results chunks per query as dicts of id, document and metadata.
+
+        With hybrid search on, a query with rare terms (names, error codes)
+        whose best BM25 hit contains all of them is answered from the lexical
+        index alone, without embedding it. Other queries fuse the BM25 and
+        vector rankings with reciprocal rank fusion.
+
+        Results are cached by normalized query text and corpus version, which
+        every write bumps, so a cached result is never older than the collection.
+        """
+        version = corpus_versions[self.collection_name]
+        queries = [normalize_query(text) for text in query_texts]
+        keys = [(self.collection_name, version, query, n_results) for query in queries]
+
+        results = [query_results.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        lexical_rankings: Dict[int, List[str]] = {}
+        if self.hybrid:
+            self.ensure_lexical()
+            for i in missing:
+                terms = self.text_cleanup(queries[i]).split()
+                ranking = [id for id, _ in self.lexical.search(terms, 2 * n_results)]
+                needles = self.lexical.needles(terms)
+
+                if needles and ranking and self.lexical.contains(ranking[0], needles):
+                    results[i] = self.fetch(ranking[:n_results])
+                    self.stats["lexical_queries"] += 1
+                else:
+                    lexical_rankings[i] = ranking
+
+        vector_missing = [i for i in missing if results[i] is None]
+        if vector_missing:
+            embeddings = self.embed_queries([queries[i] for i in vector_missing])
+            result = self.store.query(embeddings, 2 * n_results if self.hybrid else n_results)
+
+            rankings = {}
+            hits: Dict[str, Dict] = {}
+            for position, i in enumerate(vector_missing):
+                for id, document, metadata in zip(result["ids"][position], result["documents"][position], result["metadatas"][position]):
+                    hits[id] = {"id": id, "document": document, "metadata": metadata}
+                ranking = result["ids"][position]
+                if lexical_rankings.get(i):
+                    ranking = reciprocal_rank_fusion([ranking, lexical_rankings[i]], n_results)
+                    self.stats["fused_queries"] += 1
+                else:
+                    self.stats["vector_queries"] += 1
+                rankings[i] = ranking[:n_results]
+
+            # chunks only the lexical ranking found are read from the store in one go
+            lexical_only = list({id: None for ranking in rankings.values() for id in ranking if id not in hits})
+            if lexical_only:
+                hits.update((hit["id"], hit) for hit in self.fetch(lexical_only))
+            for i, ranking in rankings.items():
+                results[i] = [hits[id] for id in ranking if id in hits]
+
+        for i in missing:
+            query_results.put(keys[i], results[i])
+        return results
+
+    def fetch(self, ids: List[str]) -> List[Dict]:
+        """Hits for chunk ids, in order, read from the store; ids deleted meanwhile are skipped."""
+        result = self.store.get(ids)
+        return [
+            {"id": id, "document": document, "metadata": metadata}
+            for id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+
+    def query(self, query_texts: List[str], n_results: int = 3) -> List[List[str]]:
+        """Top n_results chunk texts per query."""
+        return [[hit["document"] for hit in hits] for hits in self.search(query_texts, n_results)]
+
+    def upsert(self, documents: List[str], documentId: str) -> Dict[str, int]:
+        return self.upsert_stream([(documentId, documents)], workers=1)
+
+    def existing_chunks(self, documentId: str) -> Dict[str, Dict]:
+        result = self.store.document_chunks(documentId)
+        return dict(zip(result["ids"], result["metadatas"]))
+
+    def upsert_stream(
+        self,
+        documents: Iterable[Tuple[str, Iterable[str]]],
+        batch_size: int = EMBED_BATCH_SIZE,
+        workers: int = CHUNK_WORKERS,
+    ) -> Dict[str, int]:
+        """Chunk, embed and write (documentId, text blocks) pairs in fixed-size batches.
+
+        Documents are read and diffed against their stored chunks by a pool of
+        worker threads, while this thread embeds and writes the batches they
+        hand over, so the next batch is being prepared while the current one
+        is embedded. The CPU-bound splitting and cleaning of each window of
+        text happens in the chunk pool's processes, so workers don't contend
+        for the GIL with each other or with this thread. Memory stays flat no
+        matter how large the documents are: each worker holds one window of
+        text and the hand-over queue is bounded.
+
+        Chunk ids are derived from a hash of the chunk text, so when a document
+        is ingested again only new chunks are embedded; chunks that merely moved
+        get their chunk_index updated and chunks that are gone are deleted.
+        Returns the number of chunks per document.
+
+        Near-duplicate fingerprints are claimed while chunking, so documents of
+        one run are checked against each other too; claims whose chunks never
+        reach the store are released when the run ends. Documents that deferred
+        to a chunk this run deleted are ingested again once it is done.
+        """
+        queue: Queue = Queue(maxsize=2 * workers)
+        documents = iter(documents)
+        documents_lock = threading.Lock()
+        aborted = threading.Event()
+        counts: Dict[str, int] = {}
+        claims: set = set()
+        orphans: Set[str] = set()
+
+        def emit(item: tuple):
+            if aborted.is_set():
+                raise PipelineAborted()
+            queue.put(item)
+
+        def next_document():
+            with documents_lock:
+                return next(documents, None)
+
+        def produce():
+            try:
+                while not aborted.is_set() and (document := next_document()) is not None:
+                    documentId, blocks = document
+                    counts[documentId] = self.prepare_document(documentId, blocks, batch_size, emit, claims)
+            except PipelineAborted:
+                pass
+            except BaseException as e:
+                queue.put(("error", e))
+            finally:
+                queue.put(None)
+
+        threads = [threading.Thread(target=produce, name="chunker", daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        error: Optional[BaseException] = None
+        texts, ids, metadatas = [], [], []
+        running = len(threads)
+        try:
+            while running:
+                item = queue.get()
+                if item is None:
+                    running -= 1
+                    continue
+                if error:
+                    continue
+
+                try:
+                    kind, *args = item
+                    if kind == "error":
+                        raise args[0]
+                    if kind == "upsert":
+                        texts += args[0]
+                        ids += args[1]
+                        metadatas += args[2]
+                        if len(texts) >= batch_size:
+                            self.upsert_chunks(texts, ids, metadatas)
+                            claims.difference_update(ids)
+                            texts, ids, metadatas = [], [], []
+                    elif kind == "update":
+                        self.update_metadatas(*args)
+                    elif kind == "delete":
+                        orphans.update(self.delete_chunks(*args))
+                except BaseException as e:
+                    error = e
+                    aborted.set()
+
+            if error:
+                raise error
+            if texts:
+                self.upsert_chunks(texts, ids, metadatas)
+                claims.difference_update(ids)
+            return counts
+        finally:
+            if claims:
+                self.near_duplicates.remove(list(claims))
+                orphans.update(self.duplicate_owners.take_chunks(claims))
+            self.rehome(orphans)
+
+    def prepare_document(self, documentId: str, blocks: Iterable[str], batch_size: int, emit: Callable[[tuple], None], claims: set) -> int:
+        existing = self.existing_chunks(documentId)
+        self.duplicate_owners.forget(documentId)
+        dedup = self.near_duplicates.enabled
+        if dedup:
+            self.ensure_index(self.near_duplicates)
+
+        seen = set()
+        texts, ids, metadatas = [], [], []
+        moved_ids, moved_metadatas = [], []
+
+        # chunk_index is the position in the document, dropped chunks included,
+        # so consecutive indexes always mean consecutive text
+        for position, text in enumerate(self.clean_chunks(blocks)):
+            content_hash = sha256_text(text)
+            id = f"{documentId}_{content_hash[:16]}"
+            if id in seen:
+                continue
+
+            if id not in existing and dedup:
+                duplicate = self.near_duplicates.claim(id, documentId, text)
+                if duplicate:
+                    owner = self.near_duplicates.document_of(duplicate)
+                    if owner is not None:
+                        self.duplicate_owners.add(duplicate, owner, documentId)
+                    self.stats["near_duplicates"] += 1
+                    continue
+                claims.add(id)
+
+            metadata = {"document_id": documentId, "chunk_index": position, "content_hash": content_hash}
+            seen.add(id)
+
+            if id not in existing:
+                texts.append(text)
+                ids.append(id)
+                metadatas.append(metadata)
+            elif existing[id].get("chunk_index") != metadata["chunk_index"]:
+                moved_ids.append(id)
+                moved_metadatas.append(metadata)
+            else:
+                self.stats["unchanged"] += 1
+
+            if len(texts) >= batch_size:
+                emit(("upsert", texts, ids, metadatas))
+                texts, ids, metadatas = [], [], []
+            if len(moved_ids) >= batch_size:
+                emit(("update", moved_ids, moved_metadatas))
+                moved_ids, moved_metadatas = [], []
+
+        if texts:
+            emit(("upsert", texts, ids, metadatas))
+        if moved_ids:
+            emit(("update", moved_ids, moved_metadatas))
+
+        stale = [id for id in existing if id not in seen]
+        if stale:
+            emit(("delete", stale))
+        return len(seen)
+
+    def copy_document(self, sourceId: str, targetId: str, batch_size: int = EMBED_BATCH_SIZE) -> int:
+        """Store the chunks of sourceId again under targetId, reusing their embeddings.
+
+        Copies skip the near-duplicate check, which would match every chunk to
+        its own source and leave targetId empty once the source is deleted.
+        The chunks the source dropped as near duplicates are recorded for
+        targetId too. Returns the number of chunks stored for targetId.
+        """
+        self.duplicate_owners.forget(targetId)
+        self.duplicate_owners.copy(sourceId, targetId)
+
+        offset, stored = 0, 0
+        while True:
+            result = self.store.document_chunks(sourceId, include_embeddings=True, limit=batch_size, offset=offset)
+            if not result["ids"]:
+                self.bump_version()
+                return stored
+            offset += len(result["ids"])
+
+            ids, documents, metadatas, embeddings = [], [], [], []
+            for id, document, metadata, embedding in zip(result["ids"], result["documents"], result["metadatas"], result["embeddings"]):
+                ids.append(id.replace(sourceId, targetId, 1))
+                documents.append(document)
+                metadatas.append({**metadata, "document_id": targetId})
+                embeddings.append(embedding)
+
+            self.store.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+            self.update_indexes("add", ids, documents, metadatas)
+            stored += len(ids)
+
+    def upsert_chunks(self, texts: List[str], ids: List[str], metadatas: List[Dict], batch_size: int = EMBED_BATCH_SIZE):
+        batch_size = min(batch_size, self.store.max_batch_size())
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            started = time.perf_counter()
+            embeddings = self.embedding_function(batch)
+            self.stats["embed_seconds"] += time.perf_counter() - started
+
+            self.store.upsert(
+                documents=batch,
+                embeddings=embeddings,
+                metadatas=metadatas[start:start + batch_size],
+                ids=ids[start:start + batch_size],
+            )
+            self.update_indexes("add", ids[start:start + batch_size], batch, metadatas[start:start + batch_size])
+            self.stats["embedded"] += len(batch)
+        self.bump_version()
+
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict]):
+        max_batch_size = self.store.max_batch_size()
+        for start in range(0, len(ids), max_batch_size):
+            end = start + max_batch_size
+            self.store.update_metadatas(ids[start:end], metadatas[start:end])
+        self.update_indexes("update_metadatas", ids, metadatas)
+        self.stats["moved"] += len(ids)
+        self.bump_version()
+
+    def delete_chunks(self, ids: List[str]) -> Set[str]:
+        """Delete chunks by id; returns the documents that deferred to one of them."""
+        max_batch_size = self.store.max_batch_size()
+        for start in range(0, len(ids), max_batch_size):
+            self.store.delete(ids[start:start + max_batch_size])
+        self.update_indexes("remove", ids)
+        self.stats["deleted"] += len(ids)
+        self.bump_version()
+        return self.duplicate_owners.take_chunks(ids)
 
     def delete(self, ids: List[str]):
+        orphans = set()
         for document_id in ids:
-            self.collection.delete(where={"document_id": {"$eq": document_id}})
+            self.store.delete_document(document_id)
+            self.update_indexes("remove_document", document_id)
+            self.duplicate_owners.forget(document_id)
+            orphans |= self.duplicate_owners.take_document(document_id)
+        self.bump_version()
+        self.rehome(orphans - set(ids))
+
+    def rehome(self, documentIds: Set[str]):
+        """Ingest again the documents that deferred to chunks which are gone, so their text is stored under them."""
+        if not documentIds:
+            return
+        if self.source is None:
+            print(f"Cannot re-ingest {len(documentIds)} documents whose near duplicates were deleted: no source")
+            return
+
+        documents = []
+        for documentId in documentIds:
+            blocks = self.source(documentId)
+            if blocks is None:
+                print(f"Cannot re-ingest document {documentId}: its text is gone")
+                continue
+            documents.append((documentId, blocks))
+
+        try:
+            self.upsert_stream(documents)
+        except Exception as e:
+            print(f"Error re-ingesting {len(documents)} documents whose near duplicates were deleted: {e}")
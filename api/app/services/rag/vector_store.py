@@ -0,0 +1,470 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from core.config import VECTOR_BACKEND, VECTOR_DB_DIR, VECTOR_COMPACT_PERCENT, VECTOR_QUANTIZATION, VECTOR_RERANK_FACTOR
+
+QUANTIZED_DTYPES = {"int8": np.int8, "float16": np.float16}
+SCAN_BLOCK_ROWS = 65536
+
+class VectorStore(ABC):
+    """Storage for chunk embeddings of one collection.
+
+    ChromaDBManager chunks and embeds text itself and only needs a store to
+    keep (id, document, embedding, metadata) rows and search them.
+    """
+
+    @abstractmethod
+    def max_batch_size(self) -> int:
+        ...
+
+    @abstractmethod
+    def upsert(self, ids: List[str], documents: List[str], embeddings: List, metadatas: List[Dict]):
+        ...
+
+    @abstractmethod
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict]):
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        ...
+
+    @abstractmethod
+    def delete_document(self, documentId: str):
+        ...
+
+    @abstractmethod
+    def document_chunks(self, documentId: str, include_embeddings: bool = False, limit: Optional[int] = None, offset: int = 0) -> Dict:
+        """Rows of a document as a dict of ids, documents, metadatas (and embeddings) lists."""
+
+    @abstractmethod
+    def get(self, ids: List[str]) -> Dict:
+        """Rows with the given ids, in that order, as ids, documents and metadatas lists; unknown ids are left out."""
+
+    @abstractmethod
+    def query(self, embeddings: List, n_results: int) -> Dict:
+        """Nearest rows per query embedding as lists of ids, documents, metadatas and distances."""
+
+    @abstractmethod
+    def iter_chunks(self, batch_size: int) -> Iterator[Dict]:
+        """Every row, in batches of ids, documents and metadatas lists."""
+
+    def stats(self) -> dict:
+        return {}
+
+class ChromaStore(VectorStore):
+    def __init__(self, collection_name: str, store_path: str = VECTOR_DB_DIR, embedding_function=None):
+        import chromadb
+
+        self.client = chromadb.PersistentClient(path=store_path)
+        self.collection = self.client.get_or_create_collection(name=collection_name, embedding_function=embedding_function)
+
+    def max_batch_size(self) -> int:
+        return self.client.get_max_batch_size()
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+    def update_metadatas(self, ids, metadatas):
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def delete_document(self, documentId):
+        self.collection.delete(where={"document_id": {"$eq": documentId}})
+
+    def document_chunks(self, documentId, include_embeddings=False, limit=None, offset=0):
+        include = ["documents", "metadatas", "embeddings"] if include_embeddings else ["metadatas"]
+        return self.collection.get(where={"document_id": {"$eq": documentId}}, include=include, limit=limit, offset=offset)
+
+    def get(self, ids):
+        result = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        rows = {id: (document, metadata) for id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"])}
+        found = [id for id in ids if id in rows]
+        return {
+            "ids": found,
+            "documents": [rows[id][0] for id in found],
+            "metadatas": [rows[id][1] for id in found],
+        }
+
+    def query(self, embeddings, n_results):
+        return self.collection.query(query_embeddings=embeddings, n_results=n_results, include=["documents", "metadatas", "distances"])
+
+    def iter_chunks(self, batch_size):
+        offset = 0
+        while True:
+            result = self.collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not result["ids"]:
+                return
+            yield result
+            offset += len(result["ids"])
+
+    def stats(self):
+        return {"backend": "chroma", "rows": self.collection.count()}
+
+class NumpyStore(VectorStore):
+    """Brute-force cosine search over a memory-mapped float32 matrix.
+
+    Rows live in vectors-<generation>.f32 and are described by an append-only
+    log-<generation>.jsonl of put/update/delete records, which is replayed on
+    open. Deleted rows only get masked out; once they make up more than
+    compact_ratio of the matrix, the live rows are rewritten into a new
+    generation and CURRENT is switched over to it.
+
+    With quantization set to int8 or float16, queries scan an in-memory
+    quantized copy of the vectors and only re-score the best
+    k * rerank_factor candidates against the float32 matrix, so just those
+    rows of the memory map are ever read.
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        store_path: str = VECTOR_DB_DIR,
+        compact_ratio: float = VECTOR_COMPACT_PERCENT / 100,
+        quantization: str = VECTOR_QUANTIZATION,
+        rerank_factor: int = VECTOR_RERANK_FACTOR,
+    ):
+        if quantization not in ("none", *QUANTIZED_DTYPES):
+            raise ValueError(f"unknown vector quantization {quantization!r}")
+
+        self.path = Path(store_path) / "numpy" / collection_name
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.compact_ratio = compact_ratio
+        self.quantization = quantization
+        self.rerank_factor = max(rerank_factor, 1)
+
+        self._lock = threading.RLock()
+        self._load()
+
+    def _files(self, generation: int):
+        return self.path / f"vectors-{generation}.f32", self.path / f"log-{generation}.jsonl"
+
+    def _load(self):
+        current = self.path / "CURRENT"
+        state = json.loads(current.read_text()) if current.exists() else {"generation": 0, "dim": 0}
+        self.generation = state["generation"]
+        self.dim = state["dim"]
+
+        self.ids: List[Optional[str]] = []
+        self.documents: List[Optional[str]] = []
+        self.metadatas: List[Optional[Dict]] = []
+        self.rows: Dict[str, int] = {}
+        self.document_rows: Dict[str, set] = {}
+        self.live = np.zeros(1024, dtype=bool)
+
+        vectors_path, log_path = self._files(self.generation)
+        if log_path.exists():
+            # a write cut short by a crash leaves a torn last line; it is cut
+            # off so the next record doesn't get appended onto it
+            good = 0
+            with open(log_path, "rb") as log:
+                for line in log:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    self._apply(record)
+                    good += len(line)
+            if good < log_path.stat().st_size:
+                os.truncate(log_path, good)
+
+        self.matrix = None
+        self.quantized = None
+        self.scales = None
+        if self.dim:
+            self._map(vectors_path, max(len(self.ids), 1))
+            for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+                rows = np.arange(start, min(start + SCAN_BLOCK_ROWS, len(self.ids)))
+                self._set_quantized(rows, self.matrix[rows])
+        self._log = open(log_path, "a")
+
+    def _index(self, row: int, metadata: Optional[Dict]):
+        """Move row between the document_rows entries of its old and new metadata."""
+        old = self.metadatas[row]
+        if old is not None:
+            rows = self.document_rows.get(old.get("document_id"))
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self.document_rows[old.get("document_id")]
+        if metadata is not None:
+            self.document_rows.setdefault(metadata.get("document_id"), set()).add(row)
+        self.metadatas[row] = metadata
+
+    def _apply(self, record: dict):
+        op = record["op"]
+        if op == "put":
+            row = record["row"]
+            while len(self.ids) <= row:
+                self.ids.append(None)
+                self.documents.append(None)
+                self.metadatas.append(None)
+            if row >= len(self.live):
+                live = np.zeros(max(2 * len(self.live), row + 1), dtype=bool)
+                live[:len(self.live)] = self.live
+                self.live = live
+            self.ids[row] = record["id"]
+            self.documents[row] = record["document"]
+            self._index(row, record["metadata"])
+            self.rows[record["id"]] = row
+            self.live[row] = True
+        elif op == "update" and record["id"] in self.rows:
+            self._index(self.rows[record["id"]], record["metadata"])
+        elif op == "delete" and record["id"] in self.rows:
+            row = self.rows.pop(record["id"])
+            self._index(row, None)
+            self.ids[row] = self.documents[row] = None
+            self.live[row] = False
+
+    def _write(self, record: dict):
+        self._apply(record)
+        self._log.write(json.dumps(record) + "\n")
+
+    def _map(self, vectors_path: Path, capacity: int):
+        """Map the vector file with room for at least capacity rows, growing it by doubling."""
+        if self.matrix is not None and self.matrix.shape[0] >= capacity:
+            return
+
+        rows = self.matrix.shape[0] if self.matrix is not None else 0
+        size = max(capacity, 2 * rows, 1024)
+        if vectors_path.exists():
+            size = max(size, vectors_path.stat().st_size // (4 * self.dim))
+
+        if self.matrix is not None:
+            self.matrix.flush()
+        self.matrix = np.memmap(vectors_path, dtype=np.float32, mode="r+" if vectors_path.exists() else "w+", shape=(size, self.dim))
+
+        if self.quantization != "none":
+            quantized = np.zeros((size, self.dim), dtype=QUANTIZED_DTYPES[self.quantization])
+            scales = np.ones(size, dtype=np.float32)
+            if self.quantized is not None:
+                quantized[:len(self.quantized)] = self.quantized
+                scales[:len(self.scales)] = self.scales
+            self.quantized, self.scales = quantized, scales
+
+    def _set_quantized(self, rows, vectors: np.ndarray):
+        if self.quantization == "int8":
+            # per-row scale so every vector uses the full int8 range
+            peaks = np.abs(vectors).max(axis=1)
+            scales = np.where(peaks == 0, 1, peaks) / 127
+            self.quantized[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[rows] = scales
+        elif self.quantization == "float16":
+            self.quantized[rows] = vectors.astype(np.float16)
+
+    def _approximate_scores(self, queries: np.ndarray, count: int) -> np.ndarray:
+        scores = np.empty((len(queries), count), dtype=np.float32)
+        for start in range(0, count, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, count)
+            block = self.quantized[start:end].astype(np.float32)
+            scores[:, start:end] = queries @ block.T
+            if self.quantization == "int8":
+                scores[:, start:end] *= self.scales[start:end]
+        return scores
+
+    def stats(self) -> dict:
+        count = len(self.ids)
+        if self.quantization == "int8":
+            scanned = count * (self.dim + 4)
+        elif self.quantization == "float16":
+            scanned = count * self.dim * 2
+        else:
+            scanned = count * self.dim * 4
+        return {
+            "backend": "numpy",
+            "rows": len(self.rows),
+            "deleted_rows": count - len(self.rows),
+            "quantization": self.quantization,
+            "scanned_bytes": scanned,
+        }
+
+    def _live_rows(self) -> np.ndarray:
+        return self.live[:len(self.ids)]
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def max_batch_size(self) -> int:
+        return 5461
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            if not self.dim:
+                self.dim = vectors.shape[1]
+                self._save_current()
+
+            rows = []
+            for id in ids:
+                row = self.rows.get(id)
+                if row is None:
+                    row = len(self.ids)
+                    self.ids.append(None)
+                    self.documents.append(None)
+                    self.metadatas.append(None)
+                rows.append(row)
+
+            self._map(self._files(self.generation)[0], len(self.ids))
+            self.matrix[rows] = vectors
+            self.matrix.flush()
+            self._set_quantized(rows, vectors)
+
+            for id, row, document, metadata in zip(ids, rows, documents, metadatas):
+                self._write({"op": "put", "row": row, "id": id, "document": document, "metadata": metadata})
+            self._log.flush()
+
+    def update_metadatas(self, ids, metadatas):
+        with self._lock:
+            for id, metadata in zip(ids, metadatas):
+                self._write({"op": "update", "id": id, "metadata": metadata})
+            self._log.flush()
+
+    def delete(self, ids):
+        with self._lock:
+            for id in ids:
+                if id in self.rows:
+                    self._write({"op": "delete", "id": id})
+            self._log.flush()
+            self._maybe_compact()
+
+    def delete_document(self, documentId):
+        with self._lock:
+            self.delete([self.ids[row] for row in self.document_rows.get(documentId, ())])
+
+    def document_chunks(self, documentId, include_embeddings=False, limit=None, offset=0):
+        with self._lock:
+            rows = sorted(self.document_rows.get(documentId, ()))[offset:offset + limit if limit else None]
+
+            result = {
+                "ids": [self.ids[row] for row in rows],
+                "documents": [self.documents[row] for row in rows],
+                "metadatas": [self.metadatas[row] for row in rows],
+            }
+            if include_embeddings:
+                result["embeddings"] = np.array(self.matrix[rows]) if rows else []
+            return result
+
+    def iter_chunks(self, batch_size):
+        with self._lock:
+            ids = list(self.rows)
+        for start in range(0, len(ids), batch_size):
+            with self._lock:
+                rows = [self.rows[id] for id in ids[start:start + batch_size] if id in self.rows]
+                batch = {
+                    "ids": [self.ids[row] for row in rows],
+                    "documents": [self.documents[row] for row in rows],
+                    "metadatas": [self.metadatas[row] for row in rows],
+                }
+            yield batch
+
+    def get(self, ids):
+        with self._lock:
+            rows = [self.rows[id] for id in ids if id in self.rows]
+            return {
+                "ids": [self.ids[row] for row in rows],
+                "documents": [self.documents[row] for row in rows],
+                "metadatas": [self.metadatas[row] for row in rows],
+            }
+
+    def query(self, embeddings, n_results):
+        queries = self._normalize(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        with self._lock:
+            count = len(self.ids)
+            if not self.rows:
+                for _ in queries:
+                    for key in result:
+                        result[key].append([])
+                return result
+
+            live = self._live_rows()
+            k = min(n_results, len(self.rows))
+
+            if self.quantization == "none":
+                scores = queries @ self.matrix[:count].T
+                scores[:, ~live] = -np.inf
+                shortlists = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                scores = self._approximate_scores(queries, count)
+                scores[:, ~live] = -np.inf
+                candidates = min(k * self.rerank_factor, len(self.rows))
+                shortlists = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+
+            for query, shortlist in zip(queries, shortlists):
+                # exact float32 scores for the shortlisted rows only
+                exact = self.matrix[shortlist] @ query
+                order = np.argsort(-exact)[:k]
+                ranked = shortlist[order]
+
+                result["ids"].append([self.ids[row] for row in ranked])
+                result["documents"].append([self.documents[row] for row in ranked])
+                result["metadatas"].append([self.metadatas[row] for row in ranked])
+                result["distances"].append([float(1 - score) for score in exact[order]])
+        return result
+
+    def _save_current(self):
+        current = self.path / "CURRENT"
+        temporary = self.path / "CURRENT.tmp"
+        temporary.write_text(json.dumps({"generation": self.generation, "dim": self.dim}))
+        os.replace(temporary, current)
+
+    def _maybe_compact(self):
+        dead = len(self.ids) - len(self.rows)
+        if dead and dead / len(self.ids) > self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the live rows into a new generation without the deleted ones."""
+        with self._lock:
+            live = sorted(self.rows.values())
+            generation = self.generation + 1
+            vectors_path, log_path = self._files(generation)
+
+            matrix = np.memmap(vectors_path, dtype=np.float32, mode="w+", shape=(max(len(live), 1), self.dim))
+            if live:
+                matrix[:len(live)] = self.matrix[live]
+            matrix.flush()
+
+            with open(log_path, "w") as log:
+                for new_row, row in enumerate(live):
+                    record = {"op": "put", "row": new_row, "id": self.ids[row], "document": self.documents[row], "metadata": self.metadatas[row]}
+                    log.write(json.dumps(record) + "\n")
+
+            old_vectors, old_log = self._files(self.generation)
+            self._log.close()
+            self.matrix = None
+            self.generation = generation
+            self._save_current()
+
+            old_vectors.unlink(missing_ok=True)
+            old_log.unlink(missing_ok=True)
+            self._load()
+
+_stores: Dict[tuple, VectorStore] = {}
+_stores_lock = threading.Lock()
+
+def create_store(collection_name: str, store_path: str = VECTOR_DB_DIR, embedding_function=None, backend: str = VECTOR_BACKEND) -> VectorStore:
+    """The store of a collection, shared by every ChromaDBManager that opens it."""
+    key = (backend, store_path, collection_name)
+    with _stores_lock:
+        if key not in _stores:
+            if backend == "numpy":
+                _stores[key] = NumpyStore(collection_name, store_path)
+            elif backend == "chroma":
+                _stores[key] = ChromaStore(collection_name, store_path, embedding_function)
+            else:
+                raise ValueError(f"unknown vector backend {backend!r}")
+        return _stores[key]
@@ -0,0 +1,179 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import httpx
+from sqlalchemy.orm.attributes import flag_modified
+from sqlmodel import Session, select, or_
+
+from core.config import RECRAWL_INTERVAL, RECRAWL_MAX_AGE, RECRAWL_BATCH_SIZE, RECRAWL_CONCURRENCY
+from core.db import engine
+from core.db.models import TrainingWebsite, TrainingStatus, JobKind, IngestionJobs
+from helpers.hashing import sha256_text
+from .crawler import site_cache, fetch_browser_page
+from .discovery import NeedsBrowser, html_to_page
+from .frontier import HostLimiter
+from .http_client import get_http_client
+from .ingestion import cromadb, write_processed_file
+from .jobs import JobContext, job_queue, run_blocking, run_to_completion
+
+stats = {"checked": 0, "not_modified": 0, "unchanged": 0, "changed": 0, "failed": 0, "skipped_runs": 0}
+
+async def fetch_if_changed(website: TrainingWebsite) -> Optional[dict]:
+    """Fetch a trained page again, or return None when the server says it is not modified."""
+    headers = {}
+    if website.etag:
+        headers["If-None-Match"] = website.etag
+    if website.last_modified:
+        headers["If-Modified-Since"] = website.last_modified
+
+    try:
+        response = await get_http_client().get(website.url, headers=headers)
+        if response.status_code == 304:
+            return None
+        if response.status_code != 200 or "html" not in response.headers.get("content-type", ""):
+            raise NeedsBrowser(website.url)
+
+        page = await asyncio.to_thread(html_to_page, response.text, str(response.url))
+        page["headers"] = dict(response.headers)
+    except (NeedsBrowser, httpx.HTTPError):
+        page = await fetch_browser_page(website.url)
+        if not page:
+            raise RuntimeError(f"could not crawl {website.url}")
+
+    cached = await site_cache.put(website.url, page["content"], title=page["title"], headers=page["headers"], links=page.get("links"))
+    return {"content": cached["markdown"], "etag": cached["etag"], "last_modified": cached["last_modified"]}
+
+def apply_recrawl(websiteId: uuid.UUID, page: Optional[dict]) -> str:
+    with Session(engine) as session:
+        website = session.get(TrainingWebsite, websiteId)
+        if not website:
+            return "failed"
+
+        now = datetime.now(timezone.utc)
+        website.checked_at = now
+        # keep updated_at for pages whose content did not change
+        flag_modified(website, "updated_at")
+
+        if page is None:
+            result = "not_modified"
+        else:
+            website.etag = page["etag"]
+            website.last_modified = page["last_modified"]
+
+            content = page["content"]
+            content_hash = sha256_text(content)
+            if content_hash == website.content_hash:
+                result = "unchanged"
+            else:
+                write_processed_file(str(website.id), content)
+                cromadb.upsert(documents=[content], documentId=str(website.id))
+
+                website.content_hash = content_hash
+                website.character_count = len(content)
+                website.updated_at = now
+                result = "changed"
+
+        session.add(website)
+        session.commit()
+        return result
+
+def due_websites(websiteIds: Optional[List[uuid.UUID]], max_age: int, limit: int) -> List[TrainingWebsite]:
+    with Session(engine) as session:
+        statement = select(TrainingWebsite).where(TrainingWebsite.status == TrainingStatus.completed)
+        if websiteIds is not None:
+            statement = statement.where(TrainingWebsite.id.in_(websiteIds))
+        else:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+            statement = (
+                statement
+                .where(or_(TrainingWebsite.checked_at == None, TrainingWebsite.checked_at < cutoff))
+                .order_by(TrainingWebsite.checked_at)
+                .limit(limit)
+            )
+        return session.exec(statement).fetchall()
+
+class RecrawlScheduler:
+    """Periodically queues a re-crawl job that re-fetches trained pages and
+    re-embeds only the ones whose content changed."""
+
+    def __init__(self, interval: int = RECRAWL_INTERVAL, max_age: int = RECRAWL_MAX_AGE, batch_size: int = RECRAWL_BATCH_SIZE, concurrency: int = RECRAWL_CONCURRENCY):
+        self.interval = interval
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _enqueue(self) -> bool:
+        # a run still pending or in progress would pick the same oldest-checked
+        # websites, so the next one is only queued once it has finished
+        with Session(engine) as session:
+            running = session.exec(
+                select(IngestionJobs.id).where(
+                    IngestionJobs.kind == JobKind.recrawl,
+                    IngestionJobs.status.in_([TrainingStatus.pending, TrainingStatus.processing]),
+                )
+            ).first()
+            if running:
+                return False
+
+            job_queue.enqueue(session, JobKind.recrawl)
+            return True
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if not await run_blocking(self._enqueue):
+                    stats["skipped_runs"] += 1
+            except Exception as e:
+                print(f"Error scheduling website re-crawl: {e}")
+
+    async def _recrawl(self, website: TrainingWebsite, limiter: HostLimiter, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            await limiter.wait(website.url)
+            try:
+                page = await fetch_if_changed(website)
+                result = await run_to_completion(apply_recrawl, website.id, page)
+            except Exception as e:
+                print(f"Error re-crawling {website.url}: {e}")
+                result = "failed"
+            finally:
+                limiter.release(website.url)
+
+        stats["checked"] += 1
+        stats[result] += 1
+        return result
+
+    async def run_once(self, websiteIds: Optional[List[uuid.UUID]] = None) -> dict:
+        websites = await run_blocking(due_websites, websiteIds, self.max_age, self.batch_size)
+
+        limiter = HostLimiter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*[self._recrawl(website, limiter, semaphore) for website in websites])
+
+        summary = {"checked": len(results), "not_modified": 0, "unchanged": 0, "changed": 0, "failed": 0}
+        for result in results:
+            summary[result] += 1
+        return summary
+
+recrawl_scheduler = RecrawlScheduler()
+
+@job_queue.handler(JobKind.recrawl)
+async def recrawl_job(job: JobContext):
+    website_ids = job.payload.get("website_ids")
+    if website_ids is not None:
+        website_ids = [uuid.UUID(website_id) for website_id in website_ids]
+
+    summary = await recrawl_scheduler.run_once(website_ids)
+    await job.progress(summary["checked"] - summary["failed"], summary["checked"])
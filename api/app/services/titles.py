@@ -0,0 +1,144 @@
+import asyncio
+import itertools
+import json
+import uuid
+from typing import Dict, List, Optional
+
+from google.genai import types
+from sqlmodel import Session, select, update
+
+from core.config import TITLE_AFTER_MESSAGES, TITLE_MAX_BATCH, TITLE_BATCH_WAIT_MS
+from core.db import engine
+from core.db.models import Conversations, ChatMessages
+from services.chat_with_gemini import client, GEMINI_MODEL
+from services.events import user_events
+
+DEFAULT_TITLE = "New Chat"
+TITLE_MESSAGE_CHARS = 500
+TITLE_MAX_CHARS = 80
+
+class TitleGenerator:
+    """Names conversations in the background, after the answer has been streamed.
+
+    Conversations waiting for a title are collected for TITLE_BATCH_WAIT_MS
+    and titled together with a single Gemini call from their first
+    TITLE_AFTER_MESSAGES messages. The owner is told through user_events
+    once a title is saved. A title the user set in the meantime is kept.
+    """
+
+    def __init__(self, max_batch: int = TITLE_MAX_BATCH, wait_ms: int = TITLE_BATCH_WAIT_MS):
+        self.max_batch = max_batch
+        self.wait_ms = wait_ms
+        self.pending: Dict[uuid.UUID, uuid.UUID] = {}
+        self.stats = {"batches": 0, "titled": 0, "failures": 0}
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def schedule(self, conversation_id: uuid.UUID, user_id: uuid.UUID):
+        self.pending[conversation_id] = user_id
+        self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.wait_ms / 1000)
+            self._wakeup.clear()
+
+            while self.pending:
+                batch = dict(itertools.islice(self.pending.items(), self.max_batch))
+                for conversation_id in batch:
+                    del self.pending[conversation_id]
+                await self._run(batch)
+
+    def _transcripts(self, conversation_ids: List[uuid.UUID]) -> Dict[uuid.UUID, str]:
+        with Session(engine) as session:
+            untitled = session.exec(
+                select(Conversations.id).where(Conversations.id.in_(conversation_ids), Conversations.title == DEFAULT_TITLE)
+            ).all()
+
+            transcripts = {}
+            for conversation_id in untitled:
+                messages = session.exec(
+                    select(ChatMessages)
+                    .where(ChatMessages.conversation_id == conversation_id)
+                    .order_by(ChatMessages.created_at, ChatMessages.id)
+                    .limit(TITLE_AFTER_MESSAGES)
+                ).all()
+                if messages:
+                    transcripts[conversation_id] = "\n".join(
+                        f"{message.sender.value}: {message.content[:TITLE_MESSAGE_CHARS]}" for message in messages
+                    )
+            return transcripts
+
+    def _save(self, titles: Dict[uuid.UUID, str]) -> List[uuid.UUID]:
+        saved = []
+        with Session(engine) as session:
+            for conversation_id, title in titles.items():
+                result = session.exec(
+                    update(Conversations)
+                    .where(Conversations.id == conversation_id, Conversations.title == DEFAULT_TITLE)
+                    .values(title=title)
+                )
+                if result.rowcount:
+                    saved.append(conversation_id)
+            session.commit()
+        return saved
+
+    async def generate(self, transcripts: List[str]) -> List[str]:
+        prompt = "\n\n".join(f"CONVERSATION {i + 1}:\n{text}" for i, text in enumerate(transcripts))
+        response = await client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            config=types.GenerateContentConfig(
+                system_instruction=(
+                    "You are a conversation analyzer. For each conversation, generate a 3-5 word clean text title "
+                    "that clearly mentions its main topic or theme. Reply with a JSON array of titles, one per "
+                    "conversation, in the same order."
+                ),
+                response_mime_type="application/json",
+                max_output_tokens=20 * len(transcripts),
+            ),
+            contents=prompt
+        )
+
+        titles = json.loads(response.text)
+        if not isinstance(titles, list) or len(titles) != len(transcripts):
+            raise ValueError(f"expected {len(transcripts)} titles, got {response.text!r}")
+        return [str(title).strip().strip('"')[:TITLE_MAX_CHARS] for title in titles]
+
+    async def _run(self, batch: Dict[uuid.UUID, uuid.UUID]):
+        try:
+            transcripts = await asyncio.to_thread(self._transcripts, list(batch))
+            if not transcripts:
+                return
+
+            titles = await self.generate(list(transcripts.values()))
+            titles = {conversation_id: title for conversation_id, title in zip(transcripts, titles) if title}
+            saved = await asyncio.to_thread(self._save, titles)
+        except Exception as e:
+            self.stats["failures"] += 1
+            print(f"Error generating titles for {len(batch)} conversations: {e}")
+            return
+
+        self.stats["batches"] += 1
+        self.stats["titled"] += len(saved)
+        for conversation_id in saved:
+            user_events.publish(batch[conversation_id], {
+                "type": "title",
+                "conversationId": str(conversation_id),
+                "title": titles[conversation_id],
+            })
+
+    def metrics(self) -> dict:
+        return {**self.stats, "pending": len(self.pending)}
+
+title_generator = TitleGenerator()
@@ -0,0 +1,114 @@
+"""Compare vector-only and hybrid (BM25 + vector) retrieval.
+
+Indexes a folder of markdown files into a throwaway store, then asks two
+kinds of generated questions and reports latency and hit quality for each
+retrieval mode:
+
+- exact: the rarest word of a chunk plus two other words from it, like a
+  question about a product name or an error code
+- phrase: eight consecutive words of a chunk
+
+A hit means the chunk the question was built from is in the top k.
+
+    cd api && python benchmarks/retrieval.py
+
+Run it from api/, where the app runs, so --docs defaults to the processed
+files the app writes.
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from core.config import PROCESSED_DIR
+from services.rag.retriever import ChromaDBManager, query_embeddings, query_results
+
+def read_blocks(path: Path, block_size: int = 64 * 1024):
+    with open(path, errors="replace") as file:
+        while block := file.read(block_size):
+            yield block
+
+def build_questions(manager: ChromaDBManager, count: int, rng: random.Random):
+    chunks = []
+    for batch in manager.store.iter_chunks(1024):
+        chunks.extend(zip(batch["ids"], batch["documents"]))
+    chunks = [(id, text.split()) for id, text in chunks if len(text.split()) >= 12]
+    sample = rng.sample(chunks, min(count, len(chunks)))
+
+    exact, phrase = [], []
+    for id, words in sample:
+        rarest = min(words, key=lambda word: len(manager.lexical.postings.get(word, ())))
+        exact.append((" ".join([rarest, *rng.sample(words, 2)]), id))
+
+        start = rng.randrange(0, len(words) - 8)
+        phrase.append((" ".join(words[start:start + 8]), id))
+    return {"exact": exact, "phrase": phrase}
+
+def run(manager: ChromaDBManager, questions, k: int):
+    query_embeddings.clear()
+    query_results.clear()
+
+    latencies, hits, reciprocal_ranks = [], 0, []
+    for question, expected in questions:
+        started = time.perf_counter()
+        results = manager.search([question], k)[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        ids = [hit["id"] for hit in results]
+        if expected in ids:
+            hits += 1
+            reciprocal_ranks.append(1 / (ids.index(expected) + 1))
+        else:
+            reciprocal_ranks.append(0)
+
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+        "hit_rate": hits / len(questions),
+        "mrr": statistics.mean(reciprocal_ranks),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", default=PROCESSED_DIR, help="folder of .md files to index")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    files = sorted(Path(args.docs).glob("*.md"))
+    if not files:
+        parser.error(f"no .md files in {args.docs}")
+
+    with tempfile.TemporaryDirectory() as store_path:
+        manager = ChromaDBManager(collection_name="benchmark", store_path=store_path)
+
+        started = time.perf_counter()
+        counts = manager.upsert_stream((file.stem, read_blocks(file)) for file in files)
+        print(f"indexed {sum(counts.values())} chunks from {len(files)} files in {time.perf_counter() - started:.1f}s")
+
+        manager.ensure_lexical()
+        questions = build_questions(manager, args.questions, random.Random(args.seed))
+
+        print(f"{'mode':<8} {'questions':<10} {'p50 ms':>8} {'p95 ms':>8} {'hit@' + str(args.k):>7} {'mrr':>6}")
+        for hybrid in (False, True):
+            manager.hybrid = hybrid
+            mode = "hybrid" if hybrid else "vector"
+            for name, items in questions.items():
+                result = run(manager, items, args.k)
+                print(
+                    f"{mode:<8} {name:<10} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                    f"{result['hit_rate']:>7.2f} {result['mrr']:>6.2f}"
+                )
+
+        stats = manager.metrics()
+        print(f"lexical-only answers: {stats['lexical_queries']}, fused: {stats['fused_queries']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+-- Brings a database created before these columns existed up to date.
+-- SQLModel.metadata.create_all only creates missing tables (ingestion_jobs
+-- is created on startup); it never alters existing ones, so run this once
+-- against an existing MySQL database before starting the new version.
+
+-- conversation summaries (conversation memory)
+ALTER TABLE conversations
+    ADD COLUMN summary TEXT NULL,
+    ADD COLUMN summarized_count INT NOT NULL DEFAULT 0;
+
+-- message order: microsecond timestamps, ties broken by id
+ALTER TABLE chat_messages
+    MODIFY COLUMN created_at DATETIME(6) NOT NULL;
+
+-- content hash of uploads, used to reuse an already trained copy
+ALTER TABLE training_docs
+    ADD COLUMN content_hash VARCHAR(64) NULL;
+CREATE INDEX ix_training_docs_content_hash ON training_docs (content_hash);
+
+-- recrawl bookkeeping of crawled pages
+ALTER TABLE training_urls
+    ADD COLUMN content_hash VARCHAR(64) NULL,
+    ADD COLUMN etag VARCHAR(255) NULL,
+    ADD COLUMN last_modified VARCHAR(255) NULL,
+    ADD COLUMN checked_at DATETIME NULL;
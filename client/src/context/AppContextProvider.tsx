@@ -4,12 +4,13 @@ import {
   useContext,
   type ReactNode,
   useLayoutEffect,
+  useEffect,
 } from "react";
 
 import { UserProps } from "@/types/userAuth";
 import { ConversationTypes } from "@/types/chat";
 import serverCall from "@/lib/serverCall";
-import { AuthEndpoints } from "@/utils/api-constant";
+import { AuthEndpoints, ChatEndpoints } from "@/utils/api-constant";
 import ChatService from "@/utils/chat";
 import AuthService from "@/utils/userAuth";
 
@@ -110,6 +111,29 @@ export const AppProvider = ({ children }: { children: ReactNode }) => {
     checkAuth();
   }, []);
 
+  useEffect(() => {
+    if (!isAuthenticated) return;
+
+    const events = new EventSource(ChatEndpoints.events, {
+      withCredentials: true,
+    });
+
+    events.addEventListener("title", (event) => {
+      const { conversationId, title } = JSON.parse(
+        (event as MessageEvent).data
+      );
+      setConversations((prev) =>
+        prev.map((conversation) =>
+          conversation.id === conversationId
+            ? { ...conversation, title }
+            : conversation
+        )
+      );
+    });
+
+    return () => events.close();
+  }, [isAuthenticated]);
+
   const values = {
     isAuthenticated,
     isLoading,
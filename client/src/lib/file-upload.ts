@@ -21,6 +21,7 @@ interface ChunkUploadResult {
   filename?: string;
   size?: number;
   mime_type?: string;
+  digest?: string;
 }
 
 interface FileCompleteResult {
@@ -51,14 +52,30 @@ export class FileUploadService {
     });
 
     try {
+      // the upload id is derived from the file's content, so resuming can
+      // only ever reuse chunks of the very same file
+      const chunkDigests = await this.digestChunks(file, totalChunks);
+      const uploadId = await this.sha256(
+        new TextEncoder().encode(chunkDigests.join(""))
+      );
+      const received = await this.getReceivedChunks(uploadId, totalChunks);
+
       for (let chunkNumber = 0; chunkNumber < totalChunks; chunkNumber++) {
+        // resume: skip chunks the server already has, but always send the
+        // last one so the server assembles the file
+        if (received.has(chunkNumber + 1) && chunkNumber + 1 < totalChunks) {
+          continue;
+        }
+
         const chunk = this.createChunk(file, chunkNumber);
 
         const result = await this.uploadChunkWithRetry(
           chunk,
           file.name,
+          uploadId,
           chunkNumber + 1,
-          totalChunks
+          totalChunks,
+          chunkDigests[chunkNumber]
         );
 
         if (!result.success) {
@@ -96,7 +113,8 @@ export class FileUploadService {
           const completeResult = await this.completeFileUpload(
             result.filename || file.name,
             result.size || file.size,
-            result.mime_type || file.type
+            result.mime_type || file.type,
+            result.digest
           );
 
           if (completeResult.success) {
@@ -138,6 +156,40 @@ export class FileUploadService {
     }
   }
 
+  private static async sha256(data: BufferSource): Promise<string> {
+    const digest = await crypto.subtle.digest("SHA-256", data);
+    return Array.from(new Uint8Array(digest))
+      .map((byte) => byte.toString(16).padStart(2, "0"))
+      .join("");
+  }
+
+  private static async digestChunks(
+    file: File,
+    totalChunks: number
+  ): Promise<string[]> {
+    const digests: string[] = [];
+    for (let chunkNumber = 0; chunkNumber < totalChunks; chunkNumber++) {
+      const chunk = this.createChunk(file, chunkNumber);
+      digests.push(await this.sha256(await chunk.arrayBuffer()));
+    }
+    return digests;
+  }
+
+  private static async getReceivedChunks(
+    uploadId: string,
+    totalChunks: number
+  ): Promise<Set<number>> {
+    try {
+      const result: { received?: number[] } = await serverCall.get(
+        FileUploadEndpoint.chunks,
+        { params: { upload_id: uploadId, total_chunks: totalChunks } }
+      );
+      return new Set(result.received || []);
+    } catch {
+      return new Set();
+    }
+  }
+
   private static createChunk(file: File, chunkIndex: number): Blob {
     const start = chunkIndex * this.CHUNK_SIZE;
     const end = Math.min(start + this.CHUNK_SIZE, file.size);
@@ -147,16 +199,20 @@ export class FileUploadService {
   private static async uploadChunkWithRetry(
     chunk: Blob,
     fileName: string,
+    uploadId: string,
     chunkNumber: number,
     totalChunks: number,
+    chunkDigest: string,
     retryCount = 0
   ): Promise<ChunkUploadResult> {
     try {
       const result = await this.uploadSingleChunk(
         chunk,
         fileName,
+        uploadId,
         chunkNumber,
-        totalChunks
+        totalChunks,
+        chunkDigest
       );
       return result;
     } catch (error) {
@@ -167,8 +223,10 @@ export class FileUploadService {
         return this.uploadChunkWithRetry(
           chunk,
           fileName,
+          uploadId,
           chunkNumber,
           totalChunks,
+          chunkDigest,
           retryCount + 1
         );
       }
@@ -182,14 +240,18 @@ export class FileUploadService {
   private static async uploadSingleChunk(
     chunk: Blob,
     fileName: string,
+    uploadId: string,
     chunkNumber: number,
-    totalChunks: number
+    totalChunks: number,
+    chunkDigest: string
   ): Promise<ChunkUploadResult> {
     const formData = new FormData();
     formData.append("file", chunk);
     formData.append("name", fileName);
+    formData.append("upload_id", uploadId);
     formData.append("chunk_number", chunkNumber.toString());
     formData.append("total_chunks", totalChunks.toString());
+    formData.append("chunk_sha256", chunkDigest);
 
     const result: ChunkUploadResult = await serverCall.post(
       FileUploadEndpoint.chunk,
@@ -202,13 +264,15 @@ export class FileUploadService {
       filename: result.filename,
       size: result.size,
       mime_type: result.mime_type,
+      digest: result.digest,
     };
   }
 
   private static async completeFileUpload(
     fileName: string,
     fileSize: number,
-    mimeType: string
+    mimeType: string,
+    digest?: string
   ): Promise<FileCompleteResult> {
     try {
       const result: FileMetadata = await serverCall.post(
@@ -217,6 +281,7 @@ export class FileUploadService {
           filename: fileName,
           size: fileSize,
           mime_type: mimeType,
+          digest,
         }
       );
 
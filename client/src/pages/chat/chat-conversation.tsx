@@ -17,11 +17,6 @@ interface ScrapingStatus {
   completed_urls: string[];
 }
 
-type History = {
-  role: "user" | "assistant";
-  content: string;
-};
-
 export default function ConversationPage() {
   const params = useParams();
   const conversationId = params.conversationId as string;
@@ -92,14 +87,9 @@ export default function ConversationPage() {
 
     setMessages((prev) => [...prev, assistantMessage]);
 
-    const historyMessages: History[] = [];
-    for (let msg of messages) {
-      historyMessages.push({ role: msg.sender, content: msg.content });
-    }
-
     await fetchSSE(
       ChatEndpoints.conversation.single(conversationId),
-      { message: input, history: historyMessages },
+      { message: input },
       (data, urls_config) => {
         setMessages((prev) => {
           return prev.map((msg) =>
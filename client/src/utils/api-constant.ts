@@ -11,6 +11,7 @@ const AuthEndpoints = {
 
 const ChatEndpoints = {
   base: getFullURL("/chat"),
+  events: getFullURL("/chat/events"),
   conversation: {
     all: getFullURL("/chat/conversations"),
     single: (id: string) => getFullURL(`/chat/${id}`),
@@ -44,6 +45,7 @@ const AdminEndpoints = {
 
 const FileUploadEndpoint = {
   chunk: getFullURL("/upload/files"),
+  chunks: getFullURL("/upload/files/chunks"),
 };
 
 export {